@@ -18,12 +18,19 @@ import json
 import pprint
 import sys
 
+import numeric
+
 CITIES = 'cities.csv'
 
 
 def fix_area(area):
 
     # YOUR CODE HERE
+    return numeric.parser.parse(area)
+
+
+def legacy_fix_area(area):
+    # fix_area before numeric.py, kept for numeric.benchmark
     if area == 'NULL':
         return None
     elif area[0] == '{':
@@ -86,9 +93,8 @@ def test():
     print "Printing three example results:"
     for n in range(5,8):
         pprint.pprint(data[n]["areaLand"])
-    #print data[8]["areaLand"] 
-    #assert data[8]["areaLand"] == 55166700.0
-    #assert data[3]["areaLand"] == None
+    assert data[8]["areaLand"] == 55166700.0
+    assert data[3]["areaLand"] == None
 
 
 if __name__ == "__main__":
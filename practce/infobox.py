@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+One streaming pipeline for the DBpedia infobox CSV files used by area.py,
+name.py, location.py and processing.py.
+
+The file is read once with csv.DictReader, skipping the 3 metadata rows
+after the header, and every row goes through a chain of fixers named in
+FIXERS:
+- 'area': areaLand with area.fix_area
+- 'name': name with name.fix_name
+- 'numeric': every column of numeric.NUMERIC_FIELDS with numeric.parser
+- 'location': adds 'location_ok', location.check_loc of point and
+  wgs84_pos#lat/long
+- 'arachnid': the label/synonym cleanup of processing.process_line; it
+  replaces the row with the processing record, so it comes last
+
+Rows are handled in batches of batch_size and the cleaned batches are
+written to a sink as they come: JsonLinesSink (one JSON document per line)
+or MongoSink (insert_many). With workers > 1 the batches are cleaned in a
+process pool; at most two batches per worker are in flight and they are
+written in file order, so memory stays bounded for files larger than RAM.
+"""
+import csv
+import json
+import pprint
+import time
+
+import area
+import location
+import name
+import numeric
+import parallel
+import processing
+
+CITIES = 'cities.csv'
+DATAFILE = 'arachnid.csv'
+METADATA_ROWS = 3
+
+
+def fix_field(field, fix):
+    def fixer(row):
+        if field in row:
+            row[field] = fix(row[field])
+        return row
+    return fixer
+
+
+def check_location(row):
+    row['location_ok'] = location.check_loc(row['point'], row['wgs84_pos#lat'],
+                                            row['wgs84_pos#long'])
+    return row
+
+
+def fix_numeric(row):
+    for field in numeric.NUMERIC_FIELDS:
+        if field in row:
+            row[field] = numeric.parser.parse(row[field])
+    return row
+
+
+FIXERS = {'area': fix_field('areaLand', area.fix_area),
+          'name': fix_field('name', name.fix_name),
+          'numeric': fix_numeric,
+          'location': check_location,
+          'arachnid': processing.process_line}
+
+
+def iter_rows(filename, skip=METADATA_ROWS):
+    # yields the rows of a DBpedia CSV file after its metadata rows
+    with open(filename, "r") as f:
+        reader = csv.DictReader(f)
+        for i in range(skip):
+            next(reader)
+        for line in reader:
+            yield line
+
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def clean_row(row, fixers):
+    for fixer in fixers:
+        row = fixer(row)
+    return row
+
+
+def clean_batch(task):
+    # fixer names instead of functions, so the task can go to a worker
+    names, batch = task
+    fixers = [FIXERS[n] for n in names]
+    return [clean_row(row, fixers) for row in batch]
+
+
+class JsonLinesSink(object):
+    def __init__(self, filename):
+        self.file = open(filename, 'w')
+
+    def write(self, batch):
+        self.file.write(''.join(json.dumps(row) + '\n' for row in batch))
+
+    def close(self):
+        self.file.close()
+
+
+class MongoSink(object):
+    def __init__(self, collection):
+        self.collection = collection
+
+    def write(self, batch):
+        if batch:
+            self.collection.insert_many(batch, ordered=False)
+
+    def close(self):
+        pass
+
+
+def run(filename, names, sink, batch_size=1000, workers=1):
+    # cleans every row of filename with the fixers in names and writes the
+    # batches to sink; returns rows, batches and rows/s
+    start = time.time()
+    stats = {'rows': 0, 'batches': 0}
+
+    def write(batch):
+        sink.write(batch)
+        stats['rows'] += len(batch)
+        stats['batches'] += 1
+
+    tasks = ((names, batch) for batch in iter_batches(iter_rows(filename), batch_size))
+    try:
+        for batch in parallel.imap_bounded(clean_batch, tasks, workers):
+            write(batch)
+    finally:
+        sink.close()
+    seconds = time.time() - start
+    stats['seconds'] = round(seconds, 3)
+    stats['rows_per_s'] = int(stats['rows'] / max(seconds, 1e-9))
+    return stats
+
+
+def test():
+    stats = run(CITIES, ['area', 'name', 'location'], JsonLinesSink('cities.jsonl'),
+                batch_size=10, workers=2)
+    pprint.pprint(stats)
+    with open('cities.jsonl') as f:
+        cities = [json.loads(line) for line in f]
+    assert [c['areaLand'] for c in cities] == [r['areaLand'] for r in area.process_file(CITIES)]
+    assert cities[14]['name'] == ['Negtemiut', 'Nightmute']
+
+    stats = run(DATAFILE, ['arachnid'], JsonLinesSink('arachnid.jsonl'))
+    pprint.pprint(stats)
+    with open('arachnid.jsonl') as f:
+        arachnids = [json.loads(line) for line in f]
+    assert arachnids == processing.process_file(DATAFILE, processing.FIELDS)
+
+
+if __name__ == "__main__":
+    test()
@@ -17,10 +17,22 @@ you would need more information. Feel free to discuss possible strategies for fi
 The rest of the code is just an example on how this function can be used.
 Changes to "process_file" function will not be take into account.
 """
+from array import array
+from collections import defaultdict
 import csv
+import math
 import pprint
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 CITIES = 'cities.csv'
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+NAN = float('nan')
 
 
 def check_loc(point, lat, longi):
@@ -52,9 +64,158 @@ def process_file(filename):
     return data
 
 
+def to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return NAN
+
+
+def read_coords(filename):
+    # names and float arrays of the point and wgs84_pos#lat/long columns;
+    # missing or unreadable values are NaN
+    names = []
+    columns = dict((c, array('d')) for c in ('point_lat', 'point_lon', 'lat', 'lon'))
+    with open(filename, "r") as f:
+        reader = csv.DictReader(f)
+        for i in range(3):
+            next(reader)
+        for line in reader:
+            point = line["point"].split()
+            if len(point) != 2:
+                point = ['NULL', 'NULL']
+            names.append(line["name"])
+            columns['point_lat'].append(to_float(point[0]))
+            columns['point_lon'].append(to_float(point[1]))
+            columns['lat'].append(to_float(line["wgs84_pos#lat"]))
+            columns['lon'].append(to_float(line["wgs84_pos#long"]))
+    return names, columns
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2 +
+         math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distances(lat1, lon1, lat2, lon2):
+    # haversine distance of every pair of rows, NaN where a value is missing
+    if np is not None:
+        p1, p2 = np.radians(np.asarray(lat1)), np.radians(np.asarray(lat2))
+        dl = np.radians(np.asarray(lon2) - np.asarray(lon1))
+        a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+        return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    result = array('d')
+    for values in zip(lat1, lon1, lat2, lon2):
+        if any(v != v for v in values):
+            result.append(NAN)
+        else:
+            result.append(haversine(*values))
+    return result
+
+
+def validate(filename, tolerance=100.0, worst=5):
+    # compares point with wgs84_pos#lat/long for every row: the two agree
+    # when they are at most tolerance meters apart
+    names, c = read_coords(filename)
+    return validate_coords(names, c, tolerance, worst)
+
+
+def validate_coords(names, c, tolerance=100.0, worst=5):
+    dist = distances(c['point_lat'], c['point_lon'], c['lat'], c['lon'])
+    known = [(d, n) for d, n in zip(dist, names) if d == d]
+    mismatched = sorted((kn for kn in known if kn[0] > tolerance), reverse=True)
+    return {'rows': len(names),
+            'missing': len(names) - len(known),
+            'consistent': len(known) - len(mismatched),
+            'mismatched': len(mismatched),
+            'max_distance': round(max(d for d, n in known), 1) if known else None,
+            'mean_distance': round(sum(d for d, n in known) / len(known), 1) if known else None,
+            'worst': [(n, round(d, 1)) for d, n in mismatched[:worst]]}
+
+
+def near_duplicates(names, lats, lons, radius=1000.0):
+    # pairs of rows at most radius meters apart. Points go into a grid of
+    # radius-sized cells (in degrees), so each one is only compared with the
+    # points of the cells around it instead of all of them.
+    cell = radius / METERS_PER_DEGREE
+    columns = int(math.ceil(360 / cell))
+    grid = defaultdict(list)
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        if lat == lat and lon == lon:
+            key = (int(math.floor(lat / cell)), int(math.floor((lon + 180) / cell)) % columns)
+            grid[key].append(i)
+    half = math.sin(radius / (2 * EARTH_RADIUS))
+    pairs = []
+    for (row, col), members in grid.items():
+        for r in (row - 1, row, row + 1):
+            # points up to the outer edge latitude of both rows can differ by
+            # at most dlon degrees of longitude; near the poles that is all
+            edge = min(90.0, (max(abs(row), abs(r)) + 1) * cell)
+            x = half / max(math.cos(math.radians(edge)), 1e-12)
+            if x >= 1:
+                near = range(columns)
+            else:
+                reach = int(math.ceil(math.degrees(2 * math.asin(x)) / cell)) + 1
+                near = set(k % columns for k in range(col - reach, col + reach + 1))
+            for k in near:
+                others = grid.get((r, k))
+                if not others:
+                    continue
+                for i in members:
+                    for j in others:
+                        if j <= i:
+                            continue
+                        d = haversine(lats[i], lons[i], lats[j], lons[j])
+                        if d <= radius:
+                            pairs.append((names[i], names[j], round(d, 1)))
+    return pairs
+
+
+def brute_force_pairs(lats, lons, radius):
+    # every pair of indexes at most radius meters apart, by comparing all of
+    # them; the reference for near_duplicates
+    n = len(lats)
+    return set((i, j) for i in range(n) for j in range(i + 1, n)
+               if haversine(lats[i], lons[i], lats[j], lons[j]) <= radius)
+
+
+def check_near_duplicates(seed=0):
+    # near_duplicates against brute_force_pairs around both poles, across
+    # the +-180 meridian and at random latitudes
+    random.seed(seed)
+    regions = [((89.5, 89.99), (-180.0, 180.0)),
+               ((-89.99, -89.5), (-180.0, 180.0)),
+               ((-60.0, 60.0), (179.9, 180.0)),
+               ((-60.0, 60.0), (-180.0, -179.9)),
+               ((-89.9, 89.9), (-180.0, 180.0))]
+    lats, lons = [], []
+    for (lat0, lat1), (lon0, lon1) in regions:
+        for _ in range(150):
+            lats.append(random.uniform(lat0, lat1))
+            lons.append(random.uniform(lon0, lon1))
+    names = list(range(len(lats)))
+    for radius in (500.0, 5000.0, 50000.0):
+        found = set((min(a, b), max(a, b)) for a, b, d in
+                    near_duplicates(names, lats, lons, radius))
+        assert found == brute_force_pairs(lats, lons, radius), radius
+
+
+def report(filename, tolerance=100.0, radius=1000.0):
+    names, c = read_coords(filename)
+    result = validate_coords(names, c, tolerance)
+    result['near_duplicates'] = near_duplicates(names, c['lat'], c['lon'], radius)
+    return result
+
+
 def test():
     assert check_loc("33.08 75.28", "33.08", "75.28") == True
     assert check_loc("44.57833333333333 -91.21833333333333", "44.5783", "-91.2183") == False
+    result = report(CITIES)
+    pprint.pprint(result)
+    assert result['mismatched'] == 0
+    check_near_duplicates()
 
 if __name__ == "__main__":
     test()
\ No newline at end of file
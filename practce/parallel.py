@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# The process pool loop shared by infobox.py, CorrectingValidity.py and
+# patent_fields.py: tasks are read lazily and handed to the pool with at most
+# in_flight tasks per worker waiting, and the results come back in task
+# order, so memory stays bounded however many tasks there are.
+
+from collections import deque
+import multiprocessing
+
+
+def imap_bounded(func, tasks, workers=1, in_flight=2):
+    # yields func(task) for every task, in order; with workers <= 1 the tasks
+    # are run in this process
+    if workers <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(pool.apply_async(func, (task,)))
+            if len(pending) >= workers * in_flight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test():
+    assert list(imap_bounded(abs, range(-50, 50), workers=3)) == [abs(i) for i in range(-50, 50)]
+    assert list(imap_bounded(abs, range(-5, 5))) == [abs(i) for i in range(-5, 5)]
+
+
+if __name__ == "__main__":
+    test()
@@ -8,10 +8,28 @@
 # You can do that by just looking at the datafile in the web UI, or programmatically.
 # For quiz purposes it does not matter, but as an exercise we suggest that you try to do it programmatically.
 # The original file is ~600MB large, you might not be able to open it in a text editor.
+#
+# iter_patents reads the concatenated documents from a single file handle
+# instead: the file is read in chunks which are fed to a parser, and a new
+# parser is started at every XML declaration, so no document is split out
+# to a file. expat does not load external DTDs, so the DOCTYPE line of each
+# document is read without fetching anything.
 
-import xml.etree.ElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import os
+import pprint
+import shutil
+import sys
+import time
+
+import split_data
 
 PATENTS = 'patent.data'
+HEADER = b'<?xml'
+CHUNK_SIZE = 1 << 20
 
 def get_root(fname):
 
@@ -19,5 +37,133 @@ def get_root(fname):
     return tree.getroot()
 
 
+def shape_patent(root):
+    # a few fields of the publication of a us-patent-grant root
+    doc = root.find('us-bibliographic-data-grant/publication-reference/document-id')
+    shaped = {'file': root.get('file'),
+              'title': root.findtext('us-bibliographic-data-grant/invention-title')}
+    for field in ('country', 'doc-number', 'kind', 'date'):
+        shaped[field] = doc.findtext(field) if doc is not None else None
+    return shaped
+
+
+def iter_patents(filename, shape=None, chunk_size=CHUNK_SIZE, errors=None):
+    # yields the root of every document of filename, or shape(root) if shape
+    # is given. Malformed documents are skipped; if errors is a list, the
+    # number and error of each of them is appended to it.
+    parser = None
+    n = -1
+    keep = len(HEADER) - 1
+    pending = b''
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            data = pending + chunk
+            pos = 0
+            start = data.find(HEADER)
+            while start != -1:
+                if parser is not None:
+                    root = finish(parser, data[pos:start], n, errors)
+                    if root is not None:
+                        yield shape(root) if shape else root
+                parser = ET.XMLParser()
+                n += 1
+                pos = start
+                start = data.find(HEADER, start + 1)
+            # the end of the chunk may be the first bytes of a declaration
+            end = len(data) if not chunk else max(pos, len(data) - keep)
+            if parser is not None:
+                parser = feed(parser, data[pos:end], n, errors)
+            pending = data[end:]
+            if not chunk:
+                break
+    if parser is not None:
+        root = finish(parser, b'', n, errors)
+        if root is not None:
+            yield shape(root) if shape else root
+
+
+def feed(parser, data, n, errors):
+    # returns False once the document turned out to be malformed
+    if parser is False or not data:
+        return parser
+    try:
+        parser.feed(data)
+        return parser
+    except SyntaxError as e:
+        if errors is not None:
+            errors.append((n, str(e)))
+        return False
+
+
+def finish(parser, data, n, errors):
+    parser = feed(parser, data, n, errors)
+    if parser is False:
+        return None
+    try:
+        return parser.close()
+    except SyntaxError as e:
+        if errors is not None:
+            errors.append((n, str(e)))
+        return None
+
+
+def split_then_parse(filename):
+    # the split_data way: one file per document, each parsed on its own
+    split_data.split_file(filename)
+    shaped = []
+    n = 0
+    while os.path.exists("{}-{}".format(filename, n)):
+        name = "{}-{}".format(filename, n)
+        try:
+            shaped.append(shape_patent(get_root(name)))
+        except SyntaxError:
+            pass
+        os.remove(name)
+        n += 1
+    return shaped
+
+
+def benchmark(filenames=('patent.data', 'patent2_5.data'), times=10000):
+    # seconds and MB/s of split_then_parse and iter_patents on the files
+    # concatenated times times
+    big = 'patents.x{}.data'.format(times)
+    with open(big, 'wb') as fout:
+        for _ in range(times):
+            for filename in filenames:
+                with open(filename, 'rb') as fin:
+                    shutil.copyfileobj(fin, fout)
+    size = os.path.getsize(big) / (1024.0 * 1024.0)
+    results = {'mb': round(size, 1)}
+    start = time.time()
+    expected = split_then_parse(big)
+    seconds = time.time() - start
+    results['split_then_parse'] = {'seconds': round(seconds, 2),
+                                   'mb_per_s': round(size / seconds, 1)}
+    start = time.time()
+    shaped = list(iter_patents(big, shape_patent))
+    seconds = time.time() - start
+    results['iter_patents'] = {'seconds': round(seconds, 2),
+                               'mb_per_s': round(size / seconds, 1)}
+    assert shaped == expected
+    results['documents'] = len(shaped)
+    os.remove(big)
+    return results
+
+
+def test():
+    errors = []
+    patents = list(iter_patents(PATENTS, shape_patent, errors=errors))
+    pprint.pprint(patents)
+    pprint.pprint(errors)
+    assert len(patents) + len(errors) == 4
+    assert patents == list(iter_patents(PATENTS, shape_patent, chunk_size=7))
+
 
-get_root(PATENTS)
\ No newline at end of file
+if __name__ == "__main__":
+    # "python patent.py benchmark" runs the benchmark, which writes about 1.2 GB
+    # of patents and as many files as it has documents
+    if sys.argv[1:] == ['benchmark']:
+        pprint.pprint(benchmark())
+    else:
+        test()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Extracts the bibliographic fields of every patent in a USPTO bulk file
+# (concatenated XML documents, see patent.py and split_data.py) into flat
+# records and writes them as column files.
+#
+# The documents are found with split_data over the memory-mapped file and
+# handed to a pool of workers in batches of offsets; each worker parses its
+# documents from its own mapping and returns the records of the batch. At
+# most two batches per worker are in flight, so memory is bounded by the
+# batch size however many patents the file has.
+#
+# Every column is stored like an Arrow string column: "<prefix>.<column>.data"
+# with the UTF-8 values one after the other and "<prefix>.<column>.offsets"
+# with n + 1 int64 offsets into it (numpy.memmap can read both).
+# "<prefix>.columns.json" lists the columns and the number of rows.
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from array import array
+import json
+import os
+import pprint
+import sys
+import time
+
+import parallel
+import split_data
+
+PATENTS = 'patent2_5.data'
+BIBLIO = 'us-bibliographic-data-grant/'
+
+COLUMNS = ["file", "publication_country", "publication_number",
+           "publication_kind", "publication_date", "application_type",
+           "application_number", "application_date", "series_code",
+           "term_of_grant", "locarno_class", "national_class",
+           "further_classes", "title", "inventors", "citations"]
+
+# 64 bit offsets; python 2 arrays have no 'q', its 'l' is 64 bit on 64 bit
+# unix
+try:
+    OFFSET_TYPE = array('q').typecode
+except ValueError:
+    OFFSET_TYPE = 'l'
+
+
+def text(root, path):
+    value = root.findtext(BIBLIO + path)
+    return value.strip() if value else ''
+
+
+def inventor_name(inventor):
+    last = inventor.findtext('addressbook/last-name') or ''
+    first = inventor.findtext('addressbook/first-name') or ''
+    return ', '.join(name for name in (last, first) if name)
+
+
+def extract_fields(root):
+    # the flat record of a us-patent-grant root; lists are joined with '; '
+    application = root.find(BIBLIO + 'application-reference')
+    return {
+        'file': root.get('file') or '',
+        'publication_country': text(root, 'publication-reference/document-id/country'),
+        'publication_number': text(root, 'publication-reference/document-id/doc-number'),
+        'publication_kind': text(root, 'publication-reference/document-id/kind'),
+        'publication_date': text(root, 'publication-reference/document-id/date'),
+        'application_type': application.get('appl-type', '') if application is not None else '',
+        'application_number': text(root, 'application-reference/document-id/doc-number'),
+        'application_date': text(root, 'application-reference/document-id/date'),
+        'series_code': text(root, 'us-application-series-code'),
+        'term_of_grant': text(root, 'us-term-of-grant/length-of-grant'),
+        'locarno_class': text(root, 'classification-locarno/main-classification'),
+        'national_class': text(root, 'classification-national/main-classification'),
+        'further_classes': '; '.join(
+            c.text.strip() for c in root.findall(
+                BIBLIO + 'classification-national/further-classification') if c.text),
+        'title': text(root, 'invention-title'),
+        'inventors': '; '.join(
+            inventor_name(i) for i in root.findall(BIBLIO + 'us-parties/inventors/inventor')),
+        'citations': str(len(root.findall(BIBLIO + 'us-references-cited/us-citation'))),
+    }
+
+
+def extract_batch(task):
+    # records of the documents at the given offsets; malformed ones are
+    # counted and skipped
+    filename, ranges = task
+    mm = split_data.open_map(filename)
+    records = []
+    errors = 0
+    try:
+        for start, end in ranges:
+            doc = split_data.view(mm, start, end)
+            try:
+                parser = ET.XMLParser()
+                parser.feed(doc)
+                records.append(extract_fields(parser.close()))
+            except SyntaxError:
+                errors += 1
+            finally:
+                if hasattr(doc, 'release'):
+                    doc.release()
+    finally:
+        mm.close()
+    return records, errors
+
+
+def iter_batches(filename, batch_size):
+    mm = split_data.open_map(filename)
+    if mm is None:
+        return
+    try:
+        batch = []
+        for span in split_data.iter_ranges(mm):
+            batch.append(span)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        mm.close()
+
+
+class ColumnWriter(object):
+    # appends batches of records to the column files of prefix
+    def __init__(self, prefix, columns=COLUMNS):
+        self.prefix = prefix
+        self.columns = columns
+        self.rows = 0
+        self.sizes = dict((c, 0) for c in columns)
+        self.data = dict((c, open('{}.{}.data'.format(prefix, c), 'wb')) for c in columns)
+        self.offsets = dict((c, open('{}.{}.offsets'.format(prefix, c), 'wb')) for c in columns)
+        for c in columns:
+            array(OFFSET_TYPE, [0]).tofile(self.offsets[c])
+
+    def write_batch(self, records):
+        for c in self.columns:
+            values = [r[c].encode('utf-8') for r in records]
+            offsets = array(OFFSET_TYPE)
+            size = self.sizes[c]
+            for value in values:
+                size += len(value)
+                offsets.append(size)
+            self.data[c].write(b''.join(values))
+            offsets.tofile(self.offsets[c])
+            self.sizes[c] = size
+        self.rows += len(records)
+
+    def close(self):
+        for c in self.columns:
+            self.data[c].close()
+            self.offsets[c].close()
+        with open('{}.columns.json'.format(self.prefix), 'w') as f:
+            json.dump({'columns': self.columns, 'rows': self.rows}, f)
+
+
+def read_column(prefix, column):
+    with open('{}.columns.json'.format(prefix)) as f:
+        rows = json.load(f)['rows']
+    offsets = array(OFFSET_TYPE)
+    with open('{}.{}.offsets'.format(prefix, column), 'rb') as f:
+        offsets.fromfile(f, rows + 1)
+    with open('{}.{}.data'.format(prefix, column), 'rb') as f:
+        data = f.read()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(rows)]
+
+
+def extract_columns(filename, prefix=None, batch_size=1000, workers=4):
+    # extracts every patent of filename to the column files of prefix and
+    # returns documents, errors and documents/s
+    prefix = prefix or '{}.columns'.format(filename)
+    start = time.time()
+    writer = ColumnWriter(prefix)
+    errors = 0
+    tasks = ((filename, batch) for batch in iter_batches(filename, batch_size))
+    try:
+        for records, failed in parallel.imap_bounded(extract_batch, tasks, workers):
+            writer.write_batch(records)
+            errors += failed
+    finally:
+        writer.close()
+    seconds = time.time() - start
+    return {'documents': writer.rows, 'errors': errors,
+            'seconds': round(seconds, 3),
+            'docs_per_s': int(writer.rows / max(seconds, 1e-9))}
+
+
+def benchmark(filenames=('patent.data', 'patent2_5.data'), times=1000,
+              workers=(1, 2, 4)):
+    # documents/s of extract_columns for each number of workers on the
+    # files concatenated times times
+    big = 'patents.x{}.data'.format(times)
+    with open(big, 'wb') as fout:
+        for _ in range(times):
+            for filename in filenames:
+                with open(filename, 'rb') as fin:
+                    fout.write(fin.read())
+    results = {}
+    for n in workers:
+        results[n] = extract_columns(big, workers=n)
+    prefix = '{}.columns'.format(big)
+    for name in [big, '{}.columns.json'.format(prefix)] + [
+            '{}.{}.{}'.format(prefix, c, ext) for c in COLUMNS for ext in ('data', 'offsets')]:
+        os.remove(name)
+    return results
+
+
+def test():
+    stats = extract_columns(PATENTS, workers=2)
+    pprint.pprint(stats)
+    prefix = '{}.columns'.format(PATENTS)
+    assert stats['documents'] == 4
+    pprint.pprint(dict((c, read_column(prefix, c)) for c in COLUMNS))
+
+
+if __name__ == "__main__":
+    # "python patent_fields.py benchmark" runs the benchmark, which extracts the patents
+    # of a 1000 times replicated file once per number of workers
+    if sys.argv[1:] == ['benchmark']:
+        pprint.pprint(benchmark())
+    else:
+        test()
@@ -40,6 +40,13 @@ import csv
 import json
 import pprint
 import re
+import subprocess
+import sys
+
+try:
+    intern
+except NameError:
+    from sys import intern
 
 DATAFILE = 'arachnid.csv'
 FIELDS ={'rdf-schema#label': 'label',
@@ -55,6 +62,92 @@ FIELDS ={'rdf-schema#label': 'label',
          'genus_label': 'genus'}
 
 
+def clean(value):
+    value = value.strip()
+    return None if value == 'NULL' else value
+
+
+def clean_interned(value):
+    # taxonomic labels repeat on almost every row ('Animal', 'Arthropod',
+    # 'Arachnid', ...), so the records share one interned string per value
+    value = value.strip()
+    return None if value == 'NULL' else intern(value)
+
+
+def parse_label(value):
+    # the label without the description in parenthesis, "Argiope (spider)"
+    # gives "Argiope"
+    return clean(value.split('(', 1)[0])
+
+
+def parse_synonym(value):
+    if value == 'NULL':
+        return None
+    if '{' in value:
+        value = value.strip()[1:-1].replace('*', '')
+    return value.split('|')
+
+
+def process_line(line):
+    # the record of a row in one pass: the label is parsed once and reused
+    # for a missing or non alphabetic name
+    label = parse_label(line['rdf-schema#label'])
+    name = line['name']
+    if name == 'NULL' or not name.isalpha():
+        name = label
+    return {'label': label,
+            'uri': clean(line['URI']),
+            'description': clean(line['rdf-schema#comment']),
+            'name': name,
+            'synonym': parse_synonym(line['synonym']),
+            'classification': {'family': clean_interned(line['family_label']),
+                               'class': clean_interned(line['class_label']),
+                               'phylum': clean_interned(line['phylum_label']),
+                               'order': clean_interned(line['order_label']),
+                               'kingdom': clean_interned(line['kingdom_label']),
+                               'genus': clean_interned(line['genus_label'])}}
+
+
+def legacy_process_line(line):
+    # process_line before the single pass, kept for benchmark()
+    tempdict = {}
+
+    for key in FIELDS:
+        if key == 'rdf-schema#label' and line[key] != 'NULL':
+            value = line[key].split('(')[0].strip()
+        elif key == 'name':
+            if line[key] == 'NULL' or line[key].isalpha() == False:
+                value = line['rdf-schema#label'].split('(')[0].strip()
+            else:
+                value = line[key].strip()
+        elif key == 'synonym' and line[key] != 'NULL':
+            if '{' in line[key]:
+                stripline = line[key].strip()[1:-1].replace("*",'')
+            else:
+                stripline = line[key]
+            value = stripline.split('|')
+        else:
+            value = line[key].strip()
+        if value == 'NULL':
+            value = None
+        tempdict[FIELDS[key]] = value
+    eachdict = { 'label': tempdict['label'],
+                 'uri': tempdict['uri'],
+                 'description': tempdict['description'],
+                 'name': tempdict['name'],
+                 'synonym': tempdict['synonym'],
+                 'classification': {
+                                    'family': tempdict['family'],
+                                    'class': tempdict['class'],
+                                    'phylum': tempdict['phylum'],
+                                    'order': tempdict['order'],
+                                    'kingdom': tempdict['kingdom'],
+                                    'genus': tempdict['genus']
+                                    }
+                }
+    return eachdict
+
+
 def process_file(filename, fields):
 
     process_fields = fields.keys()
@@ -66,45 +159,52 @@ def process_file(filename, fields):
 
         for line in reader:
             # YOUR CODE HERE
-            tempdict = {}
-
-            for key in FIELDS:
-                if key == 'rdf-schema#label' and line[key] != 'NULL':
-                    value = line[key].split('(')[0].strip()
-                elif key == 'name':
-                    if line[key] == 'NULL' or line[key].isalpha() == False:
-                        value = line['rdf-schema#label'].split('(')[0].strip()
-                    else:
-                        value = line[key].strip()
-                elif key == 'synonym' and line[key] != 'NULL':
-                    if '{' in line[key]:
-                        stripline = line[key].strip()[1:-1].replace("*",'')
-                    else:
-                        stripline = line[key]
-                    value = stripline.split('|')
-                else:
-                    value = line[key].strip()
-                if value == 'NULL':
-                    value = None
-                tempdict[FIELDS[key]] = value
-            eachdict = { 'label': tempdict['label'],
-                         'uri': tempdict['uri'],
-                         'description': tempdict['description'],
-                         'name': tempdict['name'],
-                         'synonym': tempdict['synonym'],
-                         'classification': {
-                                            'family': tempdict['family'],
-                                            'class': tempdict['class'],
-                                            'phylum': tempdict['phylum'],
-                                            'order': tempdict['order'],
-                                            'kingdom': tempdict['kingdom'],
-                                            'genus': tempdict['genus']
-                                            }
-                        }
-            data.append(eachdict)
+            data.append(process_line(line))
     return data
 
 
+def copy_rows(rows, n):
+    # n rows cycling through rows, with fresh strings like a csv reader
+    # would make for every row
+    for i in range(n):
+        row = rows[i % len(rows)]
+        yield dict((key, (value + ' ')[:-1]) for key, value in row.items())
+
+
+def measure(name, n):
+    # MB of peak RSS of building the records of n rows with process_line or
+    # legacy_process_line, relative to before building them; run in a fresh
+    # process by benchmark()
+    import resource
+    import time
+    func = {'process_line': process_line,
+            'legacy_process_line': legacy_process_line}[name]
+    with open(DATAFILE, "r") as f:
+        reader = csv.DictReader(f)
+        for i in range(3):
+            reader.next()
+        rows = list(reader)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    records = [func(row) for row in copy_rows(rows, n)]
+    seconds = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'rows': len(records), 'rows_per_s': int(n / seconds),
+            'max_rss_mb': round((after - before) / 1024.0, 1)}
+
+
+def benchmark(n=1000000):
+    # peak memory and rows/s of the records of n rows, each way measured in
+    # its own interpreter so neither sees the other's heap
+    results = {}
+    for name in ('legacy_process_line', 'process_line'):
+        code = 'import json, processing; print json.dumps(processing.measure({!r}, {}))'.format(name, n)
+        results[name] = json.loads(subprocess.check_output([sys.executable, '-c', code]))
+    results['saved_mb'] = round(results['legacy_process_line']['max_rss_mb'] -
+                                results['process_line']['max_rss_mb'], 1)
+    return results
+
+
 def parse_array(v):
     if (v[0] == "{") and (v[-1] == "}"):
         v = v.lstrip("{")
@@ -140,6 +240,18 @@ def test():
     assert data[17]["name"] == "Ogdenia"
     assert data[48]["label"] == "Hydrachnidiae"
     assert data[14]["synonym"] == ["Cyrene Peckham & Peckham"]
+    assert data[0]["classification"]["kingdom"] is data[1]["classification"]["kingdom"]
+
+    with open(DATAFILE, "r") as f:
+        reader = csv.DictReader(f)
+        for i in range(3):
+            reader.next()
+        assert [legacy_process_line(line) for line in reader] == data
 
 if __name__ == "__main__":
-    test()
\ No newline at end of file
+    # "python processing.py benchmark" runs the 1M row memory benchmark,
+    # which needs about 3 GB of RAM
+    if sys.argv[1:] == ['benchmark']:
+        pprint.pprint(benchmark())
+    else:
+        test()
\ No newline at end of file
@@ -6,43 +6,144 @@
 # So, one solution would be to split the file into separate documents,
 # so that you can process the resulting files as valid XML documents.
 
-import xml.etree.ElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import mmap
+import multiprocessing
+import os
+import pprint
+import time
 PATENTS = 'patent.data'
+HEADER = b'<?xml'
+
+try:
+    buffer
+except NameError:
+    def view(mm, start, end):
+        return memoryview(mm)[start:end]
+else:
+    # python 2 mmap has no memoryview support, buffer() is its zero-copy slice
+    def view(mm, start, end):
+        return buffer(mm, start, end - start)
+
 
 def get_root(fname):
     tree = ET.parse(fname)
     return tree.getroot()
 
 
-def split_file(filename):
+def iter_ranges(mm):
+    # (start, end) of every document: each one starts with the XML declaration
+    start = mm.find(HEADER)
+    while start != -1:
+        end = mm.find(HEADER, start + 1)
+        yield start, (end if end != -1 else len(mm))
+        start = end
+
+
+def find_documents(mm):
+    return list(iter_ranges(mm))
+
+
+def open_map(filename):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_documents(filename):
+    # yields every document as a slice of the mapped file, without copying;
+    # a slice is only valid until the next one is requested
+    mm = open_map(filename)
+    if mm is None:
+        return
+    try:
+        for start, end in find_documents(mm):
+            doc = view(mm, start, end)
+            yield doc
+            if hasattr(doc, 'release'):
+                doc.release()
+    finally:
+        mm.close()
+
+
+def throughput(size, seconds):
+    return round(size / (1024.0 * 1024.0) / max(seconds, 1e-9), 1)
+
+
+def split_file(filename, buffer_size=1 << 20):
     # we want you to split the input file into separate files
     # each containing a single patent.
     # As a hint - each patent declaration starts with the same line that was causing the error
     # The new files should be saved with filename in the following format:
     # "{}-{}".format(filename, n) where n is a counter, starting from 0.
+    start = time.time()
     n = 0
-    linecount = 0
-    with open(filename) as fin:
-        for eachline in fin:
-            if linecount == 0:
-                title = eachline 
-                linecount = linecount + 1
-            if eachline == title:
-                if n == 0:
-                    fout = open("{}-{}".format(filename, n),'w')
-                    n = n + 1
-                else:
-                    fout.close()
-                    fout = open("{}-{}".format(filename, n),'w')
-                    n = n + 1
-                fout.write(eachline)
-                    
-
-    pass
+    size = 0
+    for doc in iter_documents(filename):
+        with open("{}-{}".format(filename, n), 'wb', buffer_size) as fout:
+            fout.write(doc)
+        size += len(doc)
+        n += 1
+    seconds = time.time() - start
+    return {'documents': n, 'bytes': size, 'seconds': round(seconds, 3),
+            'mb_per_s': throughput(size, seconds)}
+
+
+def document_id(root):
+    return root.get('file')
+
+
+def parse_range(task):
+    # parses one document in a worker straight from its own mapping of the
+    # file; malformed documents give None
+    filename, start, end, func = task
+    mm = open_map(filename)
+    doc = view(mm, start, end)
+    try:
+        parser = ET.XMLParser()
+        parser.feed(doc)
+        return func(parser.close())
+    except ET.ParseError:
+        return None
+    finally:
+        if hasattr(doc, 'release'):
+            doc.release()
+        mm.close()
+
+
+def parse_documents(filename, func=document_id, workers=4):
+    # hands the document boundaries to a pool of parsers; only the offsets
+    # are sent to the workers, each maps the file itself. func gets the
+    # root element of every document and has to be picklable.
+    start = time.time()
+    mm = open_map(filename)
+    if mm is None:
+        return [], {'documents': 0, 'bytes': 0, 'errors': 0}
+    try:
+        ranges = find_documents(mm)
+    finally:
+        mm.close()
+    tasks = [(filename, s, e, func) for s, e in ranges]
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(parse_range, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    finally:
+        pool.close()
+        pool.join()
+    seconds = time.time() - start
+    size = sum(e - s for s, e in ranges)
+    return results, {'documents': len(results), 'bytes': size,
+                     'errors': results.count(None),
+                     'seconds': round(seconds, 3),
+                     'mb_per_s': throughput(size, seconds)}
 
 
 def test():
-    split_file(PATENTS)
+    pprint.pprint(split_file(PATENTS))
     for n in range(4):
         try:
             fname = "{}-{}".format(PATENTS, n)
@@ -52,6 +153,10 @@ def test():
             f.close()
         except:
             print "Could not find file {}. Check if the filename is correct!".format(fname)
+    ids, stats = parse_documents(PATENTS)
+    pprint.pprint(ids)
+    pprint.pprint(stats)
 
 
-test()
\ No newline at end of file
+if __name__ == "__main__":
+    test()
\ No newline at end of file
@@ -47,6 +47,7 @@ import codecs
 import csv
 import json
 import pprint
+import time
 
 DATAFILE = 'arachnid.csv'
 FIELDS ={'rdf-schema#label': 'label',
@@ -72,16 +73,45 @@ def add_field(filename, fields):
     return data
 
 
-def update_db(data, db):
+def update_db(data, db, batch_size=1000):
     # YOUR CODE HERE
+    # one UpdateMany per label, sent in unordered bulk_write batches; $set on
+    # the dotted path only touches binomialAuthority, so no read-modify-write
+    from pymongo import UpdateMany
     col = db.arachnid
+    col.create_index('label')
+    stats = {'matched': 0, 'modified': 0}
+    start = time.time()
+    requests = []
     for label in data:
-        colR = col.find({'label':label})
-        for eachR in colR:
-            _id = eachR['_id']
-            classification = eachR['classification']
-            classification['binomialAuthority'] = data[label]
-            col.update({"_id":_id},{"$set":{'classification':classification}})
+        requests.append(UpdateMany({'label': label},
+                                   {'$set': {'classification.binomialAuthority': data[label]}}))
+        if len(requests) == batch_size:
+            write_batch(col, requests, stats)
+            requests = []
+    if requests:
+        write_batch(col, requests, stats)
+    seconds = time.time() - start
+    stats['seconds'] = round(seconds, 3)
+    stats['labels_per_sec'] = int(len(data) / seconds) if seconds else 0
+    return stats
+
+
+def write_batch(col, requests, stats):
+    result = col.bulk_write(requests, ordered=False)
+    stats['matched'] += result.matched_count
+    stats['modified'] += result.modified_count
+
+
+def benchmark(db, n=100000):
+    # fills db.arachnid with n labelled documents and times update_db on them;
+    # db can be a local mongod database or a mongomock one
+    db.arachnid.drop()
+    db.arachnid.insert_many([{'label': 'label{}'.format(i),
+                              'classification': {'kingdom': 'Animal'}}
+                             for i in range(n)])
+    data = dict(('label{}'.format(i), 'Authority {}'.format(i % 100)) for i in range(n))
+    return update_db(data, db)
 
 
 
@@ -96,7 +126,7 @@ def test():
     client = MongoClient("mongodb://localhost:27017")
     db = client.examples
 
-    update_db(data, db)
+    pprint.pprint(update_db(data, db))
 
     updated = db.arachnid.find_one({'label': 'Opisthoncana'})
     assert updated['classification']['binomialAuthority'] == 'Embrik Strand'
@@ -1,14 +1,58 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+Takes a sample of the top level elements of an OSM file.
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+Modes:
+- stride: every k-th top level element (the default)
+- random: about one in k elements, picked by a hash of seed, type and id,
+  so the same seed always gives the same sample
+- bbox: the nodes inside a bounding box, and the ways and relations that
+  refer to one of those nodes
+- stratified: every k-th element of each type separately, with an own k
+  per type if given, so relations are not drowned out by the nodes
+
+With complete_ways the nodes referenced by the sampled ways are written as
+well, so the sampled ways stay valid. With workers > 1 the file is split
+into byte ranges at top level elements which are sampled in a process pool.
+
+Usage:
+    python sample.py [-k 8] [--mode stride] [--seed 0]
+                     [--bbox minlat,minlon,maxlat,maxlon]
+                     [--strata node=100,way=10,relation=1]
+                     [--complete-ways] [--workers 4] [osm_file] [sample_file]
+"""
+import argparse
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+from collections import Counter
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    try:
+        import xml.etree.cElementTree as ET
+    except ImportError:
+        import xml.etree.ElementTree as ET
 
 OSM_FILE = "beijing_china.osm"  # Replace this with your osm file
 SAMPLE_FILE = "sample.osm"
 
 k = 8 # Parameter: take every k-th top level element
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
+TOPLEVEL = ('node', 'way', 'relation')
+
+# OSM never nests top level elements and a raw '<' can not appear inside
+# attribute values, so every match is the start of a top level element
+toplevel_start = re.compile(br'<(node|way|relation)[\s/>]')
+
+
+def get_element(osm_file, tags=TOPLEVEL):
     """Yield element if it is the right type of tag
 
     Reference:
@@ -22,13 +66,229 @@ def get_element(osm_file, tags=('node', 'way', 'relation')):
             root.clear()
 
 
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write('<osm>\n  ')
+class Sampler(object):
+    """Decides which elements belong to the sample."""
+
+    def __init__(self, k=k, mode='stride', seed=0, bbox=None, strata=None):
+        if mode not in ('stride', 'random', 'bbox', 'stratified'):
+            raise ValueError("unknown sampling mode {}".format(mode))
+        if mode == 'bbox' and bbox is None:
+            raise ValueError("bbox mode needs a bounding box")
+        self.k = k
+        self.mode = mode
+        self.seed = seed
+        self.bbox = bbox
+        self.strata = strata or {}
+
+    def in_bbox(self, elem):
+        minlat, minlon, maxlat, maxlon = self.bbox
+        return (minlat <= float(elem.get('lat')) <= maxlat and
+                minlon <= float(elem.get('lon')) <= maxlon)
+
+    def hashed(self, elem):
+        key = "{}:{}:{}".format(self.seed, elem.tag, elem.get('id'))
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.k == 0
+
+    def selected(self, elem, index, type_index, inside):
+        """index counts all top level elements before elem, type_index the
+        ones of its type; inside holds the node ids of the bbox mode."""
+        if self.mode == 'stride':
+            return index % self.k == 0
+        elif self.mode == 'stratified':
+            return type_index % self.strata.get(elem.tag, self.k) == 0
+        elif self.mode == 'random':
+            return self.hashed(elem)
+        elif elem.tag == 'node':
+            return int(elem.get('id')) in inside
+        elif elem.tag == 'way':
+            return any(int(nd.get('ref')) in inside for nd in elem.iter('nd'))
+        return any(int(m.get('ref')) in inside for m in elem.iter('member')
+                   if m.get('type') == 'node')
+
+
+def find_shards(osm_file, count):
+    """Splits osm_file into about count byte ranges that start at a top
+    level element. Returns the XML declaration and the (start, end) list."""
+    with open(osm_file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = b''
+            if mm[:5] == b'<?xml':
+                header = mm[:mm.find(b'?>') + 2]
+            end = mm.rfind(b'</osm>')
+            first = toplevel_start.search(mm)
+            if first is None or end < 0:
+                return header, []
+            bounds = [first.start()]
+            step = (end - bounds[0]) // count
+            for i in range(1, count):
+                match = toplevel_start.search(mm, bounds[0] + i * step)
+                if match is None or match.start() >= end:
+                    break
+                if match.start() > bounds[-1]:
+                    bounds.append(match.start())
+            bounds.append(end)
+        finally:
+            mm.close()
+    return header, list(zip(bounds[:-1], bounds[1:]))
+
+
+def count_elements(osm_file, ranges):
+    """Number of top level elements of each type before every range, to
+    continue the stride and stratified counts across ranges."""
+    offsets = []
+    total = Counter()
+    with open(osm_file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for start, end in ranges:
+                offsets.append(Counter(total))
+                for match in toplevel_start.finditer(mm, start, end):
+                    total[match.group(1).decode('ascii')] += 1
+        finally:
+            mm.close()
+    return offsets
+
+
+# set in every worker by init_worker, so the id sets are sent once per
+# worker instead of once per task
+_state = {}
+
+
+def init_worker(osm_file, header, sampler, inside, refs):
+    _state.update(osm_file=osm_file, header=header, sampler=sampler,
+                  inside=inside, refs=refs)
+
+
+def iter_shard(task):
+    """Yields (element, index, type_index) for the range of task, or for the
+    whole file if the task has no range."""
+    span, offset = task[0], task[1]
+    if span is None:
+        source = _state['osm_file']
+    else:
+        with open(_state['osm_file'], 'rb') as f:
+            f.seek(span[0])
+            chunk = f.read(span[1] - span[0])
+        source = io.BytesIO(_state['header'] + b'<osm>' + chunk + b'</osm>')
+    counts = Counter(offset)
+    for elem in get_element(source):
+        index = sum(counts.values())
+        yield elem, index, counts[elem.tag]
+        counts[elem.tag] += 1
+
+
+def collect_inside(task):
+    """Ids of the nodes inside the bounding box."""
+    sampler = _state['sampler']
+    return set(int(elem.get('id')) for elem, _, _ in iter_shard(task)
+               if elem.tag == 'node' and sampler.in_bbox(elem))
+
+
+def collect_refs(task):
+    """Ids of the nodes referenced by the sampled ways."""
+    sampler, inside = _state['sampler'], _state['inside']
+    refs = set()
+    for elem, index, type_index in iter_shard(task):
+        if elem.tag == 'way' and sampler.selected(elem, index, type_index, inside):
+            refs.update(int(nd.get('ref')) for nd in elem.iter('nd'))
+    return refs
+
+
+def write_shard(task):
+    """Writes the sampled elements of the task to its part file and returns
+    the number written of each type."""
+    sampler, inside, refs = _state['sampler'], _state['inside'], _state['refs']
+    written = Counter()
+    with open(task[2], 'wb') as output:
+        for elem, index, type_index in iter_shard(task):
+            if sampler.selected(elem, index, type_index, inside) or \
+                    (elem.tag == 'node' and int(elem.get('id')) in refs):
+                # the parser may not have read the tail yet, so set it
+                elem.tail = '\n  '
+                output.write(ET.tostring(elem, encoding='utf-8'))
+                written[elem.tag] += 1
+    return written
+
+
+def run_pass(func, tasks, workers, initargs):
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_worker, initargs)
+        try:
+            return list(pool.imap(func, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    init_worker(*initargs)
+    return [func(task) for task in tasks]
+
+
+def sample(osm_file=OSM_FILE, sample_file=SAMPLE_FILE, k=k, mode='stride',
+           seed=0, bbox=None, strata=None, complete_ways=False, workers=1):
+    """Writes the sample of osm_file to sample_file and returns the number
+    of sampled elements of each type."""
+    sampler = Sampler(k, mode, seed, bbox, strata)
+    header = b''
+    if workers > 1:
+        header, ranges = find_shards(osm_file, workers * 4)
+        if mode in ('stride', 'stratified'):
+            offsets = count_elements(osm_file, ranges)
+        else:
+            offsets = [Counter() for _ in ranges]
+        spans = list(zip(ranges, offsets))
+    else:
+        spans = [(None, Counter())]
+    tasks = [(span, offset, "{}.part-{}".format(sample_file, n))
+             for n, (span, offset) in enumerate(spans)]
+
+    inside = set()
+    if mode == 'bbox':
+        initargs = (osm_file, header, sampler, inside, set())
+        for found in run_pass(collect_inside, tasks, workers, initargs):
+            inside |= found
+    refs = set()
+    if complete_ways:
+        initargs = (osm_file, header, sampler, inside, refs)
+        for found in run_pass(collect_refs, tasks, workers, initargs):
+            refs |= found
+
+    initargs = (osm_file, header, sampler, inside, refs)
+    written = Counter()
+    with open(sample_file, 'wb') as output:
+        output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        output.write(b'<osm>\n  ')
+        for task, counts in zip(tasks, run_pass(write_shard, tasks, workers, initargs)):
+            with open(task[2], 'rb') as part:
+                shutil.copyfileobj(part, output, 1 << 20)
+            os.remove(task[2])
+            written.update(counts)
+        output.write(b'</osm>')
+    return dict(written)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Sample an OSM file.")
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE)
+    parser.add_argument('sample_file', nargs='?', default=SAMPLE_FILE)
+    parser.add_argument('-k', type=int, default=k,
+                        help="take one in k elements")
+    parser.add_argument('--mode', default='stride',
+                        choices=('stride', 'random', 'bbox', 'stratified'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bbox', type=lambda v: tuple(float(c) for c in v.split(',')),
+                        help="minlat,minlon,maxlat,maxlon")
+    parser.add_argument('--strata', type=lambda v: dict(
+                            (t, int(n)) for t, n in (s.split('=') for s in v.split(','))),
+                        help="k per element type, e.g. node=100,way=10,relation=1")
+    parser.add_argument('--complete-ways', action='store_true',
+                        help="also write the nodes of the sampled ways")
+    parser.add_argument('--workers', type=int, default=1)
+    return parser.parse_args(args)
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
 
-    output.write('</osm>')
\ No newline at end of file
+if __name__ == "__main__":
+    options = parse_args()
+    print(sample(options.osm_file, options.sample_file, options.k, options.mode,
+                 options.seed, options.bbox, options.strata,
+                 options.complete_ways, options.workers))
@@ -16,7 +16,7 @@
     name as an argument and returns the fixed name.
 """
 import xml.etree.cElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import re
 import pprint
 
@@ -83,10 +83,12 @@ def for_each_num(allnum, seq):
     r = r[:-1] 
     return r
 
+non_digit = re.compile('[^0-9]')
+
 #get only the integers of a string, and standardize the header "86010" 
 def pure_num(num):
     
-    r = re.sub('[^0-9]', '', num)
+    r = non_digit.sub('', num)
     if r[:4] == "8610":
         r = "86010" + r[4:]
     elif r[:2] == '00':
@@ -94,26 +96,100 @@ def pure_num(num):
         
     return r
 
+# Cleaning rules: (key pattern, cleaner, audit report). A pattern is a regular
+# expression matched against the whole tag key, the first matching rule wins.
+RULES = [
+    (r'addr:street', correct_street_type, 'Overabbreviated'),
+    (r'addr:postcode', correct_postcode, 'wrongpostcode'),
+    (r'fax|phone', correct_number, 'wrongnumber'),
+]
+
+class TagCleaner(object):
+    """
+    Applies RULES to tag values. The rules are compiled once and every
+    distinct key is resolved to its rule once, in a dispatch dict. Cleaned
+    values are memoized in a bounded LRU dict of (key, raw value) ->
+    (cleaned value, changed), so repeated values cost a single lookup.
+    """
+    def __init__(self, rules=RULES, maxsize=100000):
+        self.rules = [(re.compile('(?:%s)$' % pattern), cleaner, report)
+                      for pattern, cleaner, report in rules]
+        self.dispatch = {}
+        self.maxsize = maxsize
+        self.memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def rule(self, key):
+        """
+        Returns the (cleaner, report) of the first rule matching key or None.
+        """
+        try:
+            return self.dispatch[key]
+        except KeyError:
+            found = None
+            for pattern, cleaner, report in self.rules:
+                if pattern.match(key):
+                    found = (cleaner, report)
+                    break
+            self.dispatch[key] = found
+            return found
+
+    def clean(self, key, value):
+        """
+        Returns the cleaned value and whether it has been changed. Values of
+        keys without a rule are returned as they are.
+        """
+        memo_key = (key, value)
+        memo = self.memo
+        if memo_key in memo:
+            self.hits += 1
+            result = memo.pop(memo_key)
+            memo[memo_key] = result
+            return result
+        rule = self.rule(key)
+        if rule is None:
+            return value, False
+        self.misses += 1
+        result = rule[0](value)
+        memo[memo_key] = result
+        if len(memo) > self.maxsize:
+            memo.popitem(last=False)
+        return result
+
+    def stats(self):
+        """
+        Hit/miss counters of the memo, for monitoring.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+                "size": len(self.memo),
+                "maxsize": self.maxsize}
+
+cleaner = TagCleaner()
+
+def audit_element(elem, audited):
+    """
+    Adds the (raw, cleaned) value of every tag of a node or way that the
+    cleaning rules change to the audit report of its rule.
+    """
+    if elem.tag == "node" or elem.tag == "way":
+        for tag in elem.iter("tag"):
+            rule = cleaner.rule(tag.attrib['k'])
+            if rule is not None:
+                v, c = cleaner.clean(tag.attrib['k'], tag.attrib['v'])
+                if c:
+                    audited[rule[1]].append((tag.attrib['v'], v))
+    return audited
+
 def audit(osmfile):
     osm_file = open(osmfile, "r")
     street_types = defaultdict(set)
-    audited = {'Overabbreviated':[], "wrongpostcode":[], "wrongnumber":[]}
+    audited = dict((report, []) for _, _, report in RULES)
     for event, elem in ET.iterparse(osm_file, events=("start",)):
-
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if tag.attrib['k'] == "addr:street":
-                    v, c = correct_street_type(tag.attrib['v'])
-                    if c:
-                        audited['Overabbreviated'].append((tag.attrib['v'], v))
-                elif tag.attrib['k'] == "addr:postcode":
-                    v, c = correct_postcode(tag.attrib['v'])
-                    if c:
-                        audited['wrongpostcode'].append((tag.attrib['v'], v))
-                elif tag.attrib['k'] == "fax" or tag.attrib['k'] == "phone":
-                    v, c = correct_number(tag.attrib['v'])
-                    if c:
-                        audited['wrongnumber'].append((tag.attrib['v'], v))
+        audited = audit_element(elem, audited)
 
     osm_file.close()
     return audited
@@ -122,6 +198,7 @@ def audit(osmfile):
 def test():
     audited = audit(OSMFILE)
     pprint.pprint(audited)
+    pprint.pprint(cleaner.stats())
 
 
 if __name__ == '__main__':
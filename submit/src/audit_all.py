@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# audit_all.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Runs all audits of the OSM file in a single pass. audit.py, general.py,
+tag.py and mapparser.py each parse the whole file; audit_all streams it once
+and hands every element to a list of visitors, which build the same reports.
+
+A visitor has a name, a visit(element) method called on the end event of
+every element (so top level elements are complete), and a report() method
+returning its result. Top level elements are cleared after the visitors
+have seen them.
+"""
+import xml.etree.cElementTree as ET
+import pprint
+
+import audit
+import general
+import pbf
+import tag
+
+OSMFILE = "sample.osm"
+
+TOPLEVEL = ("node", "way", "relation")
+
+
+class StreetAudit(object):
+    """
+    Street name, postcode and phone number audit of audit.py.
+    """
+    name = "audit"
+
+    def __init__(self):
+        self.audited = dict((report, []) for _, _, report in audit.RULES)
+
+    def visit(self, element):
+        audit.audit_element(element, self.audited)
+
+    def report(self):
+        return self.audited
+
+
+class Inventory(object):
+    """
+    Set of values of every tag key, like general.parse.
+    """
+    name = "general"
+
+    def __init__(self):
+        self.data = {}
+
+    def visit(self, element):
+        general.add_values(element, self.data)
+
+    def report(self):
+        return self.data
+
+
+class KeyTypes(object):
+    """
+    Classification of tag keys, like tag.process_map.
+    """
+    name = "tag"
+
+    def __init__(self):
+        self.keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+
+    def visit(self, element):
+        tag.key_type(element, self.keys)
+
+    def report(self):
+        return self.keys
+
+
+class Counts(object):
+    """
+    Number of elements of each tag name, like mapparser.count_tags.
+    """
+    name = "mapparser"
+
+    def __init__(self):
+        self.tags = {}
+
+    def visit(self, element):
+        self.tags[element.tag] = self.tags.get(element.tag, 0) + 1
+
+    def report(self):
+        return self.tags
+
+
+def default_visitors():
+    return [StreetAudit(), Inventory(), KeyTypes(), Counts()]
+
+
+def audit_all(osmfile, visitors=None):
+    """
+    Streams osmfile once through the visitors and returns a dictionary
+    with the report of every visitor under its name.
+    """
+    if visitors is None:
+        visitors = default_visitors()
+    visits = [v.visit for v in visitors]
+    if pbf.is_pbf(osmfile):
+        for event, element in pbf.iterparse(osmfile):
+            for visit in visits:
+                visit(element)
+        return dict((v.name, v.report()) for v in visitors)
+    context = ET.iterparse(osmfile, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event == "end":
+            for visit in visits:
+                visit(element)
+            if element.tag in TOPLEVEL:
+                root.clear()
+    return dict((v.name, v.report()) for v in visitors)
+
+
+def test():
+    reports = audit_all(OSMFILE)
+    pprint.pprint(reports["audit"])
+    pprint.pprint(reports["tag"])
+    pprint.pprint(reports["mapparser"])
+
+
+if __name__ == "__main__":
+    test()
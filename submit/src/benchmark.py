@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# benchmark.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Timings for the OSM processing scripts. Every benchmark takes the OSM file to
+run on and returns its results as a dictionary, so they can be compared
+between runs; test() prints them for OSMFILE.
+"""
+from collections import Counter
+import json
+import os
+import pprint
+import subprocess
+import sys
+import time
+
+import audit
+import audit_all
+import blockfile
+import data
+import general
+import legacy_data
+import nodestore
+import pbf
+import relations
+import mapparser
+import tag
+
+OSMFILE = "sample.osm"
+# the small extract of the exercises, for benchmarks which replicate their
+# input many times
+EXAMPLEFILE = "example.osm"
+
+
+def timed(func, *args, **kwargs):
+    """
+    Calls func and returns its result and the elapsed wall clock seconds.
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def read_lines(filename):
+    with open(filename, "rb") as f:
+        return f.read().splitlines()
+
+
+def benchmark_process_map(osmfile, workers=(1, 2, 4, 8)):
+    """
+    Runs process_map with each number of workers, checks that the JSON
+    output is the same as the single process one and reports the speedup.
+    """
+    file_out = "{0}.json".format(osmfile)
+    results = {}
+    expected = None
+    for n in workers:
+        _, seconds = timed(data.process_map, osmfile, False, n)
+        lines = [json.loads(l) for l in read_lines(file_out)]
+        if expected is None:
+            expected, base = lines, seconds
+        assert lines == expected, "{0} workers changed the output".format(n)
+        results[n] = {"seconds": round(seconds, 3),
+                      "speedup": round(base / seconds, 2)}
+    return results
+
+
+def read_elements(osmfile):
+    """
+    Parses all top level elements of osmfile into a list, so shaping can be
+    timed without the parsing.
+    """
+    context = data.ET.iterparse(osmfile, events=("start", "end"))
+    _, root = next(context)
+    elements = []
+    for event, element in context:
+        if event == "end" and element.tag in data.TOPLEVEL:
+            elements.append(element)
+    return elements
+
+
+# golden output for elements with a "type" tag, which must not replace the
+# element type
+TYPE_TAG_CASES = (
+    ('<node id="1" lat="39.9" lon="116.4" version="1">'
+     '<tag k="type" v="foo"/><tag k="name" v="A"/></node>',
+     {"type": "node", "node_type": "foo", "id": "1", "pos": [39.9, 116.4],
+      "created": {"version": "1"}, "name": "A"}),
+    ('<way id="2" version="1"><nd ref="1"/><nd ref="3"/>'
+     '<tag k="type" v="bar"/></way>',
+     {"type": "way", "way_type": "bar", "id": "2", "node_refs": ["1", "3"],
+      "created": {"version": "1"}}),
+    ('<relation id="3" version="1"><member type="way" ref="2" role="outer"/>'
+     '<tag k="type" v="multipolygon"/></relation>',
+     {"type": "relation", "relation_type": "multipolygon", "id": "3",
+      "members": [{"type": "way", "ref": "2", "role": "outer"}],
+      "created": {"version": "1"}}),
+)
+
+
+def compare_shaped(element, expected, shaped):
+    """
+    How the JSON line of shaped differs from expected, the line of the
+    frozen legacy_data.shape_element: "identical", "key_order" (the same
+    document with its keys in another order) or "type_tag" (a "type" tag,
+    which used to replace the element type, kept as <element>_type as
+    documented in data.py). Any other difference is an AssertionError.
+    """
+    if json.dumps(shaped) == json.dumps(expected):
+        return "identical"
+    category = "key_order"
+    if expected.get("type") != element.tag:
+        expected = dict(expected)
+        expected[element.tag + "_type"] = expected["type"]
+        expected["type"] = element.tag
+        category = "type_tag"
+    assert shaped == expected, "shape_element changed {0}".format(expected)
+    return category
+
+
+def benchmark_shape_element(osmfile):
+    """
+    Elements per second of shape_element against the frozen original
+    (legacy_data.shape_element), and of shape_element for each element
+    type. Before the timing, the JSON line of every node and way is
+    compared with the original one, unsorted: "lines" counts the identical
+    lines, those whose keys only come in another order, and those of
+    elements with a "type" tag; anything else fails. The original shaping
+    returned nothing for relations.
+    """
+    elements = read_elements(osmfile)
+    lines = {"identical": 0, "key_order": 0, "type_tag": 0}
+    for element in elements:
+        if element.tag == "relation":
+            continue
+        expected = legacy_data.shape_element(element)
+        lines[compare_shaped(element, expected, data.shape_element(element))] += 1
+    for source, expected in TYPE_TAG_CASES:
+        element = data.ET.fromstring(source)
+        shaped = data.shape_element(element)
+        assert shaped == expected, "shape_element changed {0}".format(expected)
+        if element.tag != "relation":
+            legacy = legacy_data.shape_element(element)
+            assert compare_shaped(element, legacy, shaped) == "type_tag"
+    results = {"lines": lines}
+    for name, func in (("before", legacy_data.shape_element),
+                       ("after", data.shape_element)):
+        _, seconds = timed(lambda: [func(e) for e in elements])
+        results[name] = int(len(elements) / seconds)
+    for tag in data.TOPLEVEL:
+        typed = [e for e in elements if e.tag == tag]
+        if typed:
+            _, seconds = timed(lambda: [data.shape_element(e) for e in typed])
+            results[tag] = int(len(typed) / max(seconds, 1e-6))
+    return results
+
+
+def benchmark_relations(osmfile):
+    """
+    Documents per second of the shaping pass with and without building the
+    way -> relation membership index.
+    """
+    plain, seconds = timed(lambda: sum(1 for _ in data.iter_shaped(osmfile)))
+    writer = relations.MembershipIndexWriter("{0}.members".format(osmfile))
+    docs = relations.index_relations(data.iter_shaped(osmfile), writer)
+    _, indexed = timed(lambda: sum(1 for _ in docs))
+    index = writer.close()
+    pairs = len(index)
+    index.close()
+    os.remove(writer.path)
+    return {"pairs": pairs,
+            "docs_per_sec": int(plain / seconds),
+            "docs_per_sec_indexed": int(plain / indexed)}
+
+
+def contains_report(single, separate):
+    """
+    Whether every value of a separate audit or general.parse report is also
+    in the single pass report of the same name.
+    """
+    for key, values in separate.items():
+        if isinstance(values, set):
+            if not values <= single.get(key, set()):
+                return False
+        elif Counter(values) - Counter(single.get(key, [])):
+            return False
+    return True
+
+
+def benchmark_audit(osmfile):
+    """
+    The four separate audit parses against the single pass of audit_all:
+    seconds of each and number of passes over the file. tag and mapparser
+    give the same reports either way. audit and general.parse look at the
+    tags on the start event, when the parser may not have read all children
+    yet, so their reports are only asserted to be contained in the single
+    pass ones, which read complete elements.
+    """
+    separate = {}
+    seconds = 0.0
+    for name, func in (("audit", audit.audit), ("general", general.parse),
+                       ("tag", tag.process_map),
+                       ("mapparser", mapparser.count_tags)):
+        separate[name], t = timed(func, osmfile)
+        seconds += t
+    reports, single = timed(audit_all.audit_all, osmfile)
+    for name in ("tag", "mapparser"):
+        assert reports[name] == separate[name], "{0} report changed".format(name)
+    for name in ("audit", "general"):
+        assert contains_report(reports[name], separate[name]), \
+            "{0} report lost values".format(name)
+    return {"separate": {"seconds": round(seconds, 3), "passes": len(separate)},
+            "single_pass": {"seconds": round(single, 3), "passes": 1}}
+
+
+def benchmark_blockfile(osmfile):
+    """
+    Write and read throughput (documents/s) and size on disk of the block
+    file, for each compression, against the JSON-lines output.
+    """
+    docs = list(data.iter_shaped(osmfile))
+    results = {}
+    file_out = "{0}.json".format(osmfile)
+    with open(file_out, "w") as fo:
+        _, write = timed(data.write_shaped, docs, fo)
+    with open(file_out) as fi:
+        _, read = timed(lambda: [json.loads(line) for line in fi])
+    results["json"] = {"write": int(len(docs) / write),
+                       "read": int(len(docs) / read),
+                       "bytes": os.path.getsize(file_out)}
+    compressions = ["none", "zlib"]
+    if blockfile.zstandard is not None:
+        compressions.append("zstd")
+    for compression in compressions:
+        path = "{0}.{1}.osmb".format(osmfile, compression)
+        _, write = timed(blockfile.write_docs, docs, path, 1000, compression)
+        reader = blockfile.BlockReader(path)
+        read_docs, read = timed(list, reader)
+        assert read_docs == json.loads(json.dumps(docs))
+        _, last = timed(reader.read_block, len(reader.blocks) - 1)
+        reader.close()
+        results[compression] = {"write": int(len(docs) / write),
+                                "read": int(len(docs) / read),
+                                "read_last_block_ms": round(last * 1000, 2),
+                                "bytes": os.path.getsize(path)}
+        os.remove(path)
+    return results
+
+
+def benchmark_pbf(osmfile, workers=(1, 2, 4)):
+    """
+    Shaping throughput (documents/s) and file size of osmfile against the
+    PBF file converted from it, decoded with each number of workers.
+    """
+    pbf_file = "{0}.pbf".format(osmfile)
+    pbf.write_pbf(osmfile, pbf_file)
+    expected, seconds = timed(lambda: list(data.iter_shaped(osmfile)))
+    results = {"xml": {"docs_per_s": int(len(expected) / seconds),
+                       "bytes": os.path.getsize(osmfile)}}
+    for n in workers:
+        docs, seconds = timed(lambda: list(data.iter_shaped(pbf_file, workers=n)))
+        assert docs == expected
+        results["pbf_{0}".format(n)] = {"docs_per_s": int(len(docs) / seconds),
+                                        "bytes": os.path.getsize(pbf_file)}
+    return results
+
+
+def benchmark_key_type(osmfile=EXAMPLEFILE, times=1000):
+    """
+    tags/s of tag.process_map on osmfile repeated times times, and of the
+    regex chain and the memoized classifier alone (tag.benchmark). The
+    replica is written to disk, so osmfile should be a small extract.
+    """
+    big = replicate_osm(osmfile, times)
+    keys, seconds = timed(tag.process_map, big)
+    os.remove(big)
+    results = tag.benchmark(osmfile, times)
+    results["process_map_tags_per_s"] = int(sum(keys.values()) / seconds)
+    return results
+
+
+def benchmark_count_tags(osmfile, workers=(1, 2, 4)):
+    """
+    Seconds of mapparser.count_tags, parsing and with the fast byte scan,
+    for each number of workers, against the original single pass.
+    """
+    expected, seconds = timed(mapparser.legacy_count_tags, osmfile)
+    results = {"legacy": round(seconds, 3)}
+    for fast in (False, True):
+        for n in workers:
+            tags, seconds = timed(mapparser.count_tags, osmfile, n, fast)
+            assert tags == expected
+            results["{0}_{1}".format("scan" if fast else "parse", n)] = round(seconds, 3)
+    return results
+
+
+def replicate_osm(osmfile, times):
+    """
+    Writes a copy of osmfile with its top level elements repeated times
+    times, to get larger inputs from a small extract. Returns the new name.
+    """
+    with open(osmfile, "rb") as f:
+        content = f.read()
+    start = data.toplevel_start.search(content).start()
+    end = content.rfind(b'</osm>')
+    file_out = "{0}.x{1}.osm".format(osmfile, times)
+    with open(file_out, "wb") as fo:
+        fo.write(content[:start])
+        for _ in range(times):
+            fo.write(content[start:end])
+        fo.write(content[end:])
+    return file_out
+
+
+# VmHWM is the peak of the interpreter's own address space; ru_maxrss is
+# kept across exec on Linux, so it also counts the pages of this process
+# which the child shared before exec, and is only used where there is no
+# /proc
+MAX_RSS_CODE = """
+import json, resource, sys
+sys.path.insert(0, {path!r})
+import {module}
+{module}.{name}(*json.loads({args!r}))
+try:
+    with open("/proc/self/status") as f:
+        rss = [l.split()[1] for l in f if l.startswith("VmHWM:")][0]
+except (IOError, IndexError):
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(rss)
+"""
+
+
+def max_rss(func, *args):
+    """
+    Runs the module level function func with the JSON arguments args in a
+    fresh interpreter and returns its peak resident memory in kB.
+    """
+    code = MAX_RSS_CODE.format(path=os.path.dirname(os.path.abspath(__file__)),
+                               module=func.__module__, name=func.__name__,
+                               args=json.dumps(args))
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return int(output.split()[-1])
+
+
+def benchmark_memory(osmfiles):
+    """
+    Peak memory of process_map for files of growing size. Streaming keeps
+    it flat, so the last file should not need much more than the first.
+    """
+    results = []
+    for osmfile in osmfiles:
+        results.append({"file": osmfile,
+                        "size": os.path.getsize(osmfile),
+                        "max_rss_kb": max_rss(data.process_map, osmfile)})
+    return results
+
+
+def benchmark_inventory(osmfile):
+    """
+    Peak memory of the exact value sets of general.parse against the fixed
+    size inventory of general.parse_inventory, and the inventory accuracy.
+    """
+    return {"exact_max_rss_kb": max_rss(general.parse, osmfile),
+            "inventory_max_rss_kb": max_rss(general.parse_inventory, osmfile),
+            "accuracy": general.check_inventory(osmfile)}
+
+
+def fill_dicts(n):
+    nodes = {}
+    for i in range(n):
+        nodes[str(i)] = {"id": str(i), "pos": [39.0 + i * 1e-7, 116.0 + i * 1e-7]}
+    return nodes
+
+
+def fill_store(n):
+    store = nodestore.NodeStore()
+    for i in range(n):
+        store.add(i, 39.0 + i * 1e-7, 116.0 + i * 1e-7)
+    return store.freeze()
+
+
+def fill_store_unordered(n):
+    store = nodestore.NodeStore()
+    for i in range(n):
+        j = (i * 7919) % n
+        store.add(j, 39.0 + j * 1e-7, 116.0 + j * 1e-7)
+    return store.freeze()
+
+
+def benchmark_node_store(n=1000000):
+    """
+    Peak memory of n nodes kept as shaped dictionaries with a pos list,
+    against a NodeStore with the nodes added in and out of id order, and
+    the bytes per node of each.
+    """
+    base = max_rss(fill_dicts, 0)
+    results = {}
+    for name, func in (("dict", fill_dicts), ("node_store", fill_store),
+                       ("node_store_unordered", fill_store_unordered)):
+        rss = max_rss(func, n)
+        results[name] = {"max_rss_kb": rss,
+                         "bytes_per_node": round((rss - base) * 1024.0 / n, 1)}
+    return results
+
+
+def test():
+    pprint.pprint(benchmark_shape_element(OSMFILE))
+    pprint.pprint(benchmark_relations(OSMFILE))
+    pprint.pprint(benchmark_process_map(OSMFILE))
+    pprint.pprint(benchmark_audit(OSMFILE))
+    pprint.pprint(benchmark_blockfile(OSMFILE))
+    pprint.pprint(benchmark_pbf(OSMFILE))
+    pprint.pprint(benchmark_key_type(EXAMPLEFILE))
+    pprint.pprint(benchmark_count_tags(OSMFILE))
+
+    big = replicate_osm(OSMFILE, 10)
+    memory = benchmark_memory([OSMFILE, big])
+    for name in (big, "{0}.json".format(big)):
+        os.remove(name)
+    pprint.pprint(memory)
+    assert memory[1]["max_rss_kb"] < memory[0]["max_rss_kb"] * 1.1
+
+    pprint.pprint(benchmark_node_store())
+
+    inventory = benchmark_inventory(OSMFILE)
+    pprint.pprint(inventory)
+    assert inventory["accuracy"]["max_distinct_error"] < 0.05
+    assert not inventory["accuracy"]["missed_top"]
+
+
+if __name__ == "__main__":
+    test()
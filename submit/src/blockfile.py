@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# blockfile.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Compact binary container for shaped documents, as an alternative to the
+JSON-lines file of data.process_map.
+
+Documents are encoded with msgpack (compact JSON when msgpack is not
+installed), each prefixed with its length, and grouped into blocks of
+block_size documents. Every block is compressed on its own (zlib by
+default, zstd when the zstandard package is installed, or none). After the
+blocks comes an index with the offset, size and document count of each
+block, so a reader can seek to block n and decode only the blocks it needs.
+
+Layout:
+    MAGIC | block 0 | block 1 | ... | index (JSON) | index size (8 bytes) | MAGIC
+"""
+import json
+import pprint
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import data
+
+OSMFILE = "sample.osm"
+
+MAGIC = b"OSMB1\n"
+LENGTH = struct.Struct("<I")
+TRAILER = struct.Struct("<Q")
+
+
+def encoder(codec):
+    if codec == "msgpack":
+        return lambda doc: msgpack.packb(doc, use_bin_type=True)
+    return lambda doc: json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+
+def decoder(codec):
+    if codec == "msgpack":
+        return lambda raw: msgpack.unpackb(raw, raw=False)
+    return lambda raw: json.loads(raw.decode("utf-8"))
+
+
+def compressor(compression, level=None):
+    if compression == "zlib":
+        return lambda raw: zlib.compress(raw, 6 if level is None else level)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+    return lambda raw: raw
+
+
+def decompressor(compression):
+    if compression == "zlib":
+        return zlib.decompress
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress
+    return lambda raw: raw
+
+
+class BlockWriter(object):
+    """
+    Writes documents to path in compressed blocks of block_size documents.
+    """
+    def __init__(self, path, block_size=1000, compression="zlib", codec=None,
+                 level=None):
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self.codec = codec or ("msgpack" if msgpack is not None else "json")
+        self.compression = compression
+        self.block_size = block_size
+        self.encode = encoder(self.codec)
+        self.compress = compressor(compression, level)
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.blocks = []
+        self.pending = []
+        self.count = 0
+
+    def write(self, doc):
+        raw = self.encode(doc)
+        self.pending.append(LENGTH.pack(len(raw)))
+        self.pending.append(raw)
+        self.count += 1
+        if self.count == self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        block = self.compress(b"".join(self.pending))
+        self.file.write(block)
+        self.blocks.append([self.offset, len(block), self.count])
+        self.offset += len(block)
+        self.pending = []
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        index = json.dumps({"codec": self.codec,
+                            "compression": self.compression,
+                            "blocks": self.blocks}).encode("utf-8")
+        self.file.write(index)
+        self.file.write(TRAILER.pack(len(index)))
+        self.file.write(MAGIC)
+        self.file.close()
+
+
+class BlockReader(object):
+    """
+    Reads a block file; read_block(n) decodes only block n.
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is not a block file".format(path))
+        self.file.seek(-(TRAILER.size + len(MAGIC)), 2)
+        size = TRAILER.unpack(self.file.read(TRAILER.size))[0]
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is truncated".format(path))
+        self.file.seek(-(size + TRAILER.size + len(MAGIC)), 2)
+        index = json.loads(self.file.read(size).decode("utf-8"))
+        self.blocks = index["blocks"]
+        self.decode = decoder(index["codec"])
+        self.decompress = decompressor(index["compression"])
+
+    def __len__(self):
+        return sum(block[2] for block in self.blocks)
+
+    def read_block(self, n):
+        offset, size, count = self.blocks[n]
+        self.file.seek(offset)
+        raw = self.decompress(self.file.read(size))
+        docs = []
+        pos = 0
+        for _ in range(count):
+            length = LENGTH.unpack_from(raw, pos)[0]
+            pos += LENGTH.size
+            docs.append(self.decode(raw[pos:pos + length]))
+            pos += length
+        return docs
+
+    def iter_blocks(self, start=0):
+        for n in range(start, len(self.blocks)):
+            for doc in self.read_block(n):
+                yield doc
+
+    def __iter__(self):
+        return self.iter_blocks()
+
+    def close(self):
+        self.file.close()
+
+
+def write_docs(docs, path, block_size=1000, compression="zlib", codec=None):
+    """
+    Writes docs to a block file and returns the number of documents.
+    """
+    writer = BlockWriter(path, block_size, compression, codec)
+    count = 0
+    for doc in docs:
+        writer.write(doc)
+        count += 1
+    writer.close()
+    return count
+
+
+def process_map(file_in, block_size=1000, compression="zlib"):
+    """
+    Like data.process_map, writing a block file "<file_in>.osmb" instead.
+    """
+    return write_docs(data.iter_shaped(file_in), "{0}.osmb".format(file_in),
+                      block_size, compression)
+
+
+def test():
+    process_map(OSMFILE)
+    reader = BlockReader("{0}.osmb".format(OSMFILE))
+    pprint.pprint(reader.read_block(len(reader.blocks) - 1)[-1])
+    reader.close()
+
+
+if __name__ == "__main__":
+    test()
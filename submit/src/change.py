@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# change.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Applies OSM change files (.osc) to already converted data instead of
+converting the whole extract again. A change file has <create>, <modify>
+and <delete> blocks of nodes, ways and relations; each element is shaped
+with data.shape_element (including the audit cleaning) and turned into an
+operation on the document with the same (type, id):
+
+    ("upsert", key, version, doc)
+    ("delete", key, version, None)
+
+Operations whose created.version is not newer than the stored document's
+are stale and skipped. The operations can be applied to the JSON-lines
+output of data.process_map (apply_to_file) or to a MongoDB collection
+(apply_to_collection).
+"""
+import xml.etree.cElementTree as ET
+import codecs
+import json
+import os
+import pprint
+
+import data
+
+ACTIONS = ("create", "modify", "delete")
+
+OSCFILE = "sample.osc"
+JSONFILE = "sample.osm.json"
+
+
+def key_of(doc):
+    """
+    (type, id) of a stored document; shape_element keeps a "type" tag apart
+    from the element type, so doc["type"] is always node, way or relation.
+    """
+    return doc["type"], doc["id"]
+
+
+def element_key(element):
+    return element.tag, element.attrib.get("id")
+
+
+def version_of(doc):
+    return int(doc.get("created", {}).get("version", 0))
+
+
+def sort_key(key):
+    """
+    Position of a document in process_map output: nodes, ways, relations,
+    each by id.
+    """
+    return data.TOPLEVEL.index(key[0]), int(key[1])
+
+
+def iter_changes(osc_file):
+    """
+    Yields (action, (type, id), shaped document) for every element of the
+    change file. The key is taken from the element, not from the document,
+    whose fields tags can overwrite.
+    """
+    context = ET.iterparse(osc_file, events=("start", "end"))
+    _, root = next(context)
+    block = root
+    action = None
+    for event, element in context:
+        if event == "start" and element.tag in ACTIONS:
+            block, action = element, element.tag
+        elif event == "end" and element.tag in data.TOPLEVEL and action:
+            doc = data.shape_element(element)
+            if doc:
+                yield action, element_key(element), doc
+            block.clear()
+        elif event == "end" and element.tag in ACTIONS:
+            root.clear()
+            block, action = root, None
+
+
+def operations(osc_file):
+    """
+    The latest operation for every (type, id) changed by osc_file.
+    """
+    ops = {}
+    for action, key, doc in iter_changes(osc_file):
+        version = version_of(doc)
+        if key in ops and ops[key][2] >= version:
+            continue
+        if action == "delete":
+            ops[key] = ("delete", key, version, None)
+        else:
+            ops[key] = ("upsert", key, version, doc)
+    return ops
+
+
+def apply_to_file(json_in, osc_file, json_out, pretty = False):
+    """
+    Writes json_in with the changes applied to json_out. json_in has to be
+    process_map output (one document per line, in file order); unchanged
+    lines are copied as they are and new documents are merged in at their
+    place, so the result is what process_map gives for the updated file.
+    """
+    ops = operations(osc_file)
+    stats = {"upsert": 0, "delete": 0, "stale": 0}
+    creates = sorted((key for key in ops if ops[key][0] == "upsert"),
+                     key=sort_key, reverse=True)
+    seen = set()
+
+    def dump(doc):
+        if pretty:
+            return json.dumps(doc, indent=2) + "\n"
+        return json.dumps(doc) + "\n"
+
+    def write_creates(fo, before):
+        while creates and (before is None or sort_key(creates[-1]) < before):
+            key = creates.pop()
+            if key not in seen:
+                fo.write(dump(ops[key][3]))
+                stats["upsert"] += 1
+
+    with codecs.open(json_in, "r") as fi, codecs.open(json_out, "w") as fo:
+        for line in fi:
+            doc = json.loads(line)
+            key = key_of(doc)
+            write_creates(fo, sort_key(key))
+            seen.add(key)
+            op = ops.get(key)
+            if op is None:
+                fo.write(line)
+            elif op[2] <= version_of(doc):
+                stats["stale"] += 1
+                fo.write(line)
+            elif op[0] == "delete":
+                stats["delete"] += 1
+            else:
+                stats["upsert"] += 1
+                fo.write(dump(op[3]))
+        write_creates(fo, None)
+    return stats
+
+
+def apply_to_collection(osc_file, collection, batch_size = 1000):
+    """
+    Applies the changes to a MongoDB collection of shaped documents with
+    ReplaceOne upserts and DeleteOne operations in bulk_write batches.
+    """
+    from pymongo import DeleteOne, ReplaceOne
+    stats = {"upsert": 0, "delete": 0, "stale": 0}
+    ops = list(operations(osc_file).values())
+    for start in range(0, len(ops), batch_size):
+        batch = ops[start:start + batch_size]
+        stored = {}
+        for doc in collection.find({"id": {"$in": [op[1][1] for op in batch]}},
+                                   {"type": 1, "id": 1, "created.version": 1}):
+            stored[key_of(doc)] = version_of(doc)
+        requests = []
+        for action, key, version, doc in batch:
+            if key in stored and version <= stored[key]:
+                stats["stale"] += 1
+                continue
+            selector = {"type": key[0], "id": key[1]}
+            if action == "upsert":
+                requests.append(ReplaceOne(selector, doc, upsert=True))
+            elif key in stored:
+                requests.append(DeleteOne(selector))
+            else:
+                continue
+            stats[action] += 1
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+    return stats
+
+
+def check_full(old_osm, osc_file, new_osm):
+    """
+    Asserts that applying osc_file to the conversion of old_osm gives the
+    same documents as converting new_osm, the extract with the changes.
+    """
+    data.process_map(old_osm)
+    data.process_map(new_osm)
+    updated = "{0}.updated.json".format(old_osm)
+    stats = apply_to_file("{0}.json".format(old_osm), osc_file, updated)
+    with open(updated) as f:
+        applied = [json.loads(line) for line in f]
+    with open("{0}.json".format(new_osm)) as f:
+        expected = [json.loads(line) for line in f]
+    assert applied == expected
+    return stats
+
+
+# a small extract, a change to it and the extract with the change applied;
+# nodes 2 and 4 and way 11 have a "type" tag
+OLD_OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="39.9" lon="116.4" version="1"/>
+  <node id="2" lat="39.9" lon="116.5" version="1"><tag k="type" v="foo"/></node>
+  <node id="3" lat="39.9" lon="116.6" version="1"/>
+  <way id="10" version="1"><nd ref="1"/><nd ref="2"/><tag k="highway" v="residential"/></way>
+</osm>
+"""
+CHANGE_OSC = """<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+  <modify>
+    <node id="2" lat="39.95" lon="116.5" version="2"><tag k="type" v="foo"/></node>
+    <node id="1" lat="30.0" lon="116.4" version="1"/>
+  </modify>
+  <delete>
+    <node id="3" lat="39.9" lon="116.6" version="2"/>
+  </delete>
+  <create>
+    <node id="4" lat="39.8" lon="116.5" version="1"><tag k="type" v="bar"/></node>
+    <way id="11" version="1"><nd ref="2"/><nd ref="4"/><tag k="type" v="baz"/></way>
+  </create>
+</osmChange>
+"""
+NEW_OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="39.9" lon="116.4" version="1"/>
+  <node id="2" lat="39.95" lon="116.5" version="2"><tag k="type" v="foo"/></node>
+  <node id="4" lat="39.8" lon="116.5" version="1"><tag k="type" v="bar"/></node>
+  <way id="10" version="1"><nd ref="1"/><nd ref="2"/><tag k="highway" v="residential"/></way>
+  <way id="11" version="1"><nd ref="2"/><nd ref="4"/><tag k="type" v="baz"/></way>
+</osm>
+"""
+
+
+def test():
+    names = {"change_old.osm": OLD_OSM, "change.osc": CHANGE_OSC,
+             "change_new.osm": NEW_OSM}
+    for name, text in names.items():
+        with open(name, "w") as f:
+            f.write(text)
+    stats = check_full("change_old.osm", "change.osc", "change_new.osm")
+    pprint.pprint(stats)
+    assert stats == {"upsert": 3, "delete": 1, "stale": 1}
+    for name in list(names) + ["change_old.osm.json", "change_new.osm.json",
+                               "change_old.osm.updated.json"]:
+        os.remove(name)
+    if os.path.exists(JSONFILE) and os.path.exists(OSCFILE):
+        stats = apply_to_file(JSONFILE, OSCFILE, "{0}.updated".format(JSONFILE))
+        pprint.pprint(stats)
+
+
+if __name__ == "__main__":
+    test()
@@ -11,6 +11,12 @@ import pprint
 import re
 import codecs
 import json
+import io
+import mmap
+import multiprocessing
+import os
+import shutil
+import pbf
 from audit import *
 '''
 Transforms the shape of OpenStreetMap data (an OSM XML file) into a list of
@@ -39,6 +45,15 @@ dictionaries with the following structure:
     "internet_access" : "wlan"
 }
 
+"type" is always the element type: "node", "way" or "relation". A "type"
+tag of the element (every multipolygon or route relation has one, some
+nodes and ways too) is stored as "<element>_type" instead, e.g.
+"relation_type" : "multipolygon", "node_type" : "..." or "way_type" : "...".
+Before, on nodes and ways the tag value replaced "type", so consumers that
+read the tag from "type" have to read node_type / way_type now. Ways also
+have "node_refs" : ["<node id>", ...] and relations have
+"members" : [{"type": "way", "ref": "<id>", "role": "outer"}, ...].
+
 process_map parses the map file, calls shape_element, and returns a dictionary
 containing the reshaped data for that element. A way to save the data to a file
 is provided, for use with mongoimport later on to import the shaped data into
@@ -52,6 +67,8 @@ problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
 
+TOPLEVEL = ("node", "way", "relation")
+
 
 def shape_element(element):
     """
@@ -60,24 +77,25 @@ def shape_element(element):
     street name, it returns with an updated full street name.
     """
     node = {}
-    # you should process only 2 types of top level tags: "node" and "way"
-    if element.tag == "node" or element.tag == "way" :
-        for key in element.attrib.keys():
-            val = element.attrib[key]
+    # process the 3 types of top level tags: "node", "way" and "relation"
+    if element.tag in TOPLEVEL:
+        attrib = element.attrib
+        if attrib:
             node["type"] = element.tag
 
-            # deal with top-level tags  
-            node = process_toptags(key,val, node)
-            
-            # Begin iterating over subtags
-            node = process_subtags(element, node)
-            
-        for tag in element.iter("nd"):
-            if not "node_refs" in node.keys():
-                node["node_refs"] = []
-            node_refs = node["node_refs"]
-            node_refs.append(tag.attrib["ref"])
-            node["node_refs"] = node_refs
+        # deal with top-level tags, each attribute is visited once
+        for key, val in attrib.items():
+            node = process_toptags(key, val, node)
+
+        # Begin iterating over subtags, each child is visited once
+        node = process_subtags(element, node, bool(attrib))
+
+        # a "type" tag (almost every relation has one: multipolygon,
+        # route...) is kept apart from the element type, as relation_type,
+        # node_type or way_type
+        if attrib and node["type"] != element.tag:
+            node[element.tag + "_type"] = node["type"]
+            node["type"] = element.tag
 
         return node
     else:
@@ -90,98 +108,225 @@ def process_toptags(key, val, node):
     """
     # If key in CREATED list, store key-val under "created"
     if key in CREATED:
-        if not "created" in node.keys():
+        if not "created" in node:
             node["created"] = {}
         node["created"][key] = val
         
-    # Fetch coordinates 
+    # Fetch coordinates, the pos list is created once and filled in place
     elif key == "lat" or key == "lon":
-        if not "pos" in node.keys():
+        if not "pos" in node:
             node["pos"] = [0.0, 0.0]
-        old_pos = node["pos"]
-        if key == "lat":
-            new_pos = [float(val), old_pos[1]]
-        else:
-            new_pos = [old_pos[0], float(val)]
-        node["pos"] = new_pos
+        node["pos"][1 if key == "lon" else 0] = float(val)
     else:
         node[key] = val
         
     return node
 
-def process_subtags(element, node):
+def process_subtags(element, node, with_tags = True):
     """
-    Iterating over subtags and store key and fixed value to node dict. 
+    Iterating over subtags once: stores the key and fixed value of each tag
+    to node dict, collects the refs of nd tags into node_refs and the
+    type, ref and role of member tags into members.
     """
-    
-    for tag in element.iter("tag"):
-        tag_key = tag.attrib['k']
-        tag_val = tag.attrib['v']
-        
-        # Check for problem characters
-        if problemchars.match(tag_key):
-            continue
-        
-        # fix tag 'v' attribute of streetname and postcode
-        elif tag_key.startswith("addr:"):
-            if not "address" in node.keys():
-                node["address"] = {}
-            addr_key = tag.attrib['k'][len("addr:") : ]
-            if lower_colon.match(addr_key):
-                continue
-            else:
-                if tag.attrib['k'] == "addr:street":
-                    fixed_v, change = correct_street_type(tag_val)
-                elif tag.attrib['k'] == "addr:postcode":
-                    fixed_v, change = correct_postcode(tag.attrib['v'])
-                else:
-                    fixed_v = tag_val
-                if fixed_v != None:
-                    node["address"][addr_key] = fixed_v
-        
-        # fix fax and phone number
-        elif tag_key == "fax" or tag_key == "phone":
-            fixed_v, chang = correct_number(tag_val)
-            node[tag_key] = fixed_v
-            
-        #fix multiple tag_key confusing. These two tag_key in the list have same meaing, 
-        #so just keep the latter one in the list and change the former to the latter
-        elif tag_key in [ u'应急避难场所疏散人数万人',u'应急避难场所疏散人口万人']:
-            node[u'应急避难场所疏散人口万人'] = tag_val
-            
-        # '疏散人数' and '疏散人数（万）' are two similar tag_key. Inthis way below, we change '疏散人数' to '疏散人数（万）'
-        # by doing some math.
-        elif tag_key == u'疏散人数':
-            node[u'疏散人数（万）'] = str(round(float(tag_val.split()[0].replace(',',''))/10000,2))
-        elif tag_val != None:
-            node[tag_key] = tag_val
-            
+    node_refs = []
+    members = []
+    for tag in element:
+        if tag.tag == "nd":
+            node_refs.append(tag.attrib["ref"])
+        elif tag.tag == "member":
+            members.append({"type": tag.attrib.get("type"),
+                            "ref": tag.attrib.get("ref"),
+                            "role": tag.attrib.get("role", "")})
+        elif tag.tag == "tag" and with_tags:
+            node = process_tag(tag.attrib['k'], tag.attrib['v'], node)
+    if node_refs:
+        node["node_refs"] = node_refs
+    if members:
+        node["members"] = members
+    return node
+
+def process_tag(tag_key, tag_val, node):
+    """
+    Stores the key and fixed value of a single tag to node dict.
+    """
+    # Check for problem characters
+    if problemchars.match(tag_key):
+        return node
+
+    # fix tag 'v' attribute of streetname and postcode
+    elif tag_key.startswith("addr:"):
+        if not "address" in node:
+            node["address"] = {}
+        addr_key = tag_key[len("addr:") : ]
+        if lower_colon.match(addr_key):
+            return node
+        else:
+            fixed_v, change = cleaner.clean(tag_key, tag_val)
+            if fixed_v != None:
+                node["address"][addr_key] = fixed_v
+
+    # fix fax and phone number
+    elif tag_key == "fax" or tag_key == "phone":
+        fixed_v, chang = cleaner.clean(tag_key, tag_val)
+        node[tag_key] = fixed_v
+
+    #fix multiple tag_key confusing. These two tag_key in the list have same meaing,
+    #so just keep the latter one in the list and change the former to the latter
+    elif tag_key in [ u'应急避难场所疏散人数万人',u'应急避难场所疏散人口万人']:
+        node[u'应急避难场所疏散人口万人'] = tag_val
+
+    # '疏散人数' and '疏散人数（万）' are two similar tag_key. Inthis way below, we change '疏散人数' to '疏散人数（万）'
+    # by doing some math.
+    elif tag_key == u'疏散人数':
+        node[u'疏散人数（万）'] = str(round(float(tag_val.split()[0].replace(',',''))/10000,2))
+    elif tag_val != None:
+        node[tag_key] = tag_val
+
     return node
 
-def process_map(file_in, pretty = False):
+def iter_shaped(file_in, node_store = None, workers = 1):
+    """
+    Yields the shaped dictionary of every node, way and relation. Each top
+    level element is cleared together with its processed siblings once it
+    has been shaped, so memory does not grow with the size of the file.
+    The coordinates of the nodes are also added to node_store if given
+    (see nodestore.NodeStore). A .pbf file_in is read with pbf.iter_elements,
+    decoding its blobs in workers processes.
+    """
+    for element in iter_toplevel(file_in, workers):
+        el = shape_element(element)
+        if el:
+            if node_store is not None:
+                node_store.add_shaped(el)
+            yield el
+
+def iter_toplevel(file_in, workers = 1):
+    """
+    Yields every node, way and relation element of an XML or PBF file.
+    """
+    if pbf.is_pbf(file_in):
+        for element in pbf.iter_elements(file_in, workers):
+            yield element
+        return
+    context = ET.iterparse(file_in, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event == "end" and element.tag in TOPLEVEL:
+            yield element
+            root.clear()
+
+def write_shaped(docs, fo, pretty = False):
+    """
+    Writes shaped documents as JSON lines and returns the summary stats:
+    number of documents per type, in total and the bytes written.
+    """
+    stats = {"total": 0, "bytes": 0}
+    for el in docs:
+        if pretty:
+            line = json.dumps(el, indent=2)+"\n"
+        else:
+            line = json.dumps(el) + "\n"
+        fo.write(line)
+        stats[el["type"]] = stats.get(el["type"], 0) + 1
+        stats["total"] += 1
+        stats["bytes"] += len(line)
+    return stats
+
+def merge_stats(total, stats):
+    for key in stats:
+        total[key] = total.get(key, 0) + stats[key]
+    return total
+
+def process_map(file_in, pretty = False, workers = 1):
     """
     Outputs a JSON file with the correct structure.
-    Returns the data as a list of dictionaries.
+    Returns the summary stats of write_shaped; use iter_shaped to get the
+    data itself. With workers > 1 the file is split into shards that are
+    shaped in a process pool, see process_map_parallel; PBF files have
+    their blobs decoded in the pool instead.
     """
+    if workers > 1 and not pbf.is_pbf(file_in):
+        return process_map_parallel(file_in, pretty, workers)
     file_out = "{0}.json".format(file_in)
-    data = []
     with codecs.open(file_out, "w") as fo:
-        for _, element in ET.iterparse(file_in):
-            el = shape_element(element)
-            if el:
-                data.append(el)
-                if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
-                else:
-                    fo.write(json.dumps(el) + "\n")
-    return data
+        return write_shaped(iter_shaped(file_in, workers=workers), fo, pretty)
+
+# start of a top level element; OSM never nests node/way/relation and a raw
+# '<' can not appear inside attribute values, so every match is a boundary
+toplevel_start = re.compile(br'<(?:node|way|relation)[\s/>]')
+
+def find_shards(file_in, count):
+    """
+    Splits the file into about count byte ranges, each starting at a top
+    level element and together covering every element up to '</osm>'.
+    Returns the XML declaration (so shards decode like the original file)
+    and the list of (start, end) offsets.
+    """
+    with open(file_in, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = b''
+            if mm[:5] == b'<?xml':
+                header = mm[:mm.find(b'?>') + 2]
+            end = mm.rfind(b'</osm>')
+            first = toplevel_start.search(mm)
+            if first is None or end < 0:
+                return header, []
+            bounds = [first.start()]
+            step = (end - bounds[0]) // count
+            for i in range(1, count):
+                match = toplevel_start.search(mm, bounds[0] + i * step)
+                if match is None or match.start() >= end:
+                    break
+                if match.start() > bounds[-1]:
+                    bounds.append(match.start())
+            bounds.append(end)
+        finally:
+            mm.close()
+    return header, list(zip(bounds[:-1], bounds[1:]))
+
+def process_shard(task):
+    """
+    Shapes the elements of one byte range and writes them as JSON lines to
+    the shard's part file. Returns the part file name and its stats.
+    """
+    file_in, header, start, end, part_out, pretty = task
+    with open(file_in, "rb") as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+    source = io.BytesIO(header + b'<osm>' + chunk + b'</osm>')
+    with codecs.open(part_out, "w") as fo:
+        return part_out, write_shaped(iter_shaped(source), fo, pretty)
+
+def process_map_parallel(file_in, pretty = False, workers = 4, shards = None):
+    """
+    Same output as process_map, but shards are shaped in a pool of workers
+    processes and their part files are merged back in file order.
+    """
+    file_out = "{0}.json".format(file_in)
+    header, ranges = find_shards(file_in, shards or workers * 4)
+    tasks = [(file_in, header, start, end, "{0}.part-{1}".format(file_out, n), pretty)
+             for n, (start, end) in enumerate(ranges)]
+    stats = {"total": 0, "bytes": 0}
+    pool = multiprocessing.Pool(workers)
+    try:
+        with open(file_out, "wb") as fo:
+            for part_out, part_stats in pool.imap(process_shard, tasks):
+                with open(part_out, "rb") as fp:
+                    shutil.copyfileobj(fp, fo, 1 << 20)
+                os.remove(part_out)
+                merge_stats(stats, part_stats)
+    finally:
+        pool.close()
+        pool.join()
+    return stats
 
 def test():
     # NOTE: if you are running this code on your computer, with a larger dataset, 
     # call the process_map procedure with pretty=False. The pretty=True option adds 
     # additional spaces to the output, making it significantly larger.
-    data = process_map('sample.osm', False)
-    #pprint.pprint(data[:2])
+    stats = process_map('sample.osm', False)
+    pprint.pprint(stats)
 
 
 if __name__ == "__main__":
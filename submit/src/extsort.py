@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# extsort.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+External sort of fixed size records, shared by the way membership index of
+relations.py and the node index of geometry.py.
+
+At most chunk_size records are kept in memory; each full chunk is sorted
+and written as a run file next to the output. close() merges the runs with
+heapq.merge into a single sorted file of records and removes them, so
+memory is bounded however many records are added.
+"""
+import heapq
+import os
+import pprint
+import random
+import struct
+
+
+def read_records(path, record):
+    """
+    Yields the unpacked records of a file of record (a struct.Struct).
+    """
+    with open(path, "rb", 1 << 20) as f:
+        while True:
+            data = f.read(record.size)
+            if len(data) < record.size:
+                return
+            yield record.unpack(data)
+
+
+class ExternalSorter(object):
+    """
+    Sorts tuples packed with record into path with bounded memory.
+    """
+    def __init__(self, path, record, chunk_size=1 << 20):
+        self.path = path
+        self.record = record
+        self.chunk_size = chunk_size
+        self.items = []
+        self.runs = []
+
+    def add(self, item):
+        self.items.append(item)
+        if len(self.items) >= self.chunk_size:
+            self.flush()
+
+    def new_run(self):
+        return "{0}.run-{1}".format(self.path, len(self.runs))
+
+    def add_run(self, path):
+        """
+        Takes over a file of records that is already sorted as one of the
+        runs; it is removed by close().
+        """
+        run = self.new_run()
+        os.rename(path, run)
+        self.runs.append(run)
+
+    def flush(self):
+        if not self.items:
+            return
+        run = self.new_run()
+        pack = self.record.pack
+        with open(run, "wb", 1 << 20) as f:
+            for item in sorted(self.items):
+                f.write(pack(*item))
+        self.runs.append(run)
+        self.items = []
+
+    def discard(self):
+        """
+        Removes the runs without writing path.
+        """
+        for run in self.runs:
+            if os.path.exists(run):
+                os.remove(run)
+        self.runs = []
+        self.items = []
+
+    def close(self):
+        """
+        Writes all records in order to path and returns their number.
+        """
+        self.flush()
+        count = 0
+        pack = self.record.pack
+        with open(self.path, "wb", 1 << 20) as f:
+            for item in heapq.merge(*[read_records(run, self.record)
+                                      for run in self.runs]):
+                f.write(pack(*item))
+                count += 1
+        for run in self.runs:
+            os.remove(run)
+        return count
+
+
+def test():
+    record = struct.Struct("<qd")
+    items = [(random.randint(-1000, 1000), random.random()) for _ in range(10000)]
+    sorter = ExternalSorter("extsort.test", record, chunk_size=777)
+    for item in items:
+        sorter.add(item)
+    assert sorter.close() == len(items)
+    assert list(read_records("extsort.test", record)) == sorted(items)
+    pprint.pprint({"records": len(items), "runs": len(sorter.runs)})
+    os.remove("extsort.test")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,31 +1,207 @@
 ﻿# -*- coding: utf-8 -*- 
 import xml.etree.cElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, Counter
+import hashlib
+import math
 import pprint
 import json
+import random
+import struct
+
+def add_values(elem, data):
+    """
+    Adds the value of every tag of a node or way to the set of its key.
+    """
+    if elem.tag == "node" or elem.tag == "way":
+        for tag in elem.iter("tag"):
+            k = tag.attrib['k'].encode('utf-8')
+            v = tag.attrib['v'].encode('utf-8')
+            if not k in data:
+                data[k] = set([v])
+            else:
+                data[k].add(v)
+    return data
+
 def parse(file):
-    fout = open('general.txt','w')
     data = {}
     for event, elem in ET.iterparse(file,events=("start",)):
+        data = add_values(elem, data)
+    return data
+
+def write(data, filename='general.txt'):
+    fout = open(filename,'w')
+    for k in data:
+        fout.write(k+':\n')
+        for v in data[k]:
+            fout.write(v+'|  ')
+        fout.write('\n\n')
+    fout.write('\n\nkeys:\n')
+    for k in data:
+        fout.write(k+'\n')
+    fout.close()
+    #pprint.pprint(data.keys())
+
+class HyperLogLog(object):
+    """
+    Approximate distinct count in 2**p one byte registers; the standard
+    error is about 1.04 / sqrt(2**p), 1.6% for the default p = 12.
+    """
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        h = struct.unpack(">Q", hashlib.md5(value.encode('utf-8')).digest()[:8])[0]
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - rest.bit_length() + 1
+        i = h >> (64 - self.p)
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(b'\x00')
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving(object):
+    """
+    The k most frequent values (space-saving algorithm). Every value seen
+    more than n / k times is kept; counts are over-estimated by at most
+    their error.
+    """
+    def __init__(self, k=20):
+        self.k = k
+        self.counts = {}
+
+    def add(self, value):
+        if value in self.counts:
+            self.counts[value][0] += 1
+        elif len(self.counts) < self.k:
+            self.counts[value] = [1, 0]
+        else:
+            victim = min(self.counts, key=lambda v: self.counts[v][0])
+            count = self.counts.pop(victim)[0]
+            self.counts[value] = [count + 1, count]
+
+    def top(self):
+        """
+        [value, count, error] of the kept values, most frequent first.
+        """
+        return sorted(([v, c, e] for v, (c, e) in self.counts.items()),
+                      key=lambda item: (-item[1], item[0]))
+
+
+class Reservoir(object):
+    """
+    Uniform random sample of size values.
+    """
+    def __init__(self, size=10, rng=None):
+        self.size = size
+        self.seen = 0
+        self.values = []
+        self.rng = rng or random.Random(0)
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            i = self.rng.randrange(self.seen)
+            if i < self.size:
+                self.values[i] = value
+
+
+class KeyInventory(object):
+    """
+    Fixed size summary of the values of one key.
+    """
+    def __init__(self, k=20, sample_size=10, p=12, rng=None):
+        self.count = 0
+        self.distinct = HyperLogLog(p)
+        self.top = SpaceSaving(k)
+        self.sample = Reservoir(sample_size, rng)
+
+    def add(self, value):
+        self.count += 1
+        self.distinct.add(value)
+        self.top.add(value)
+        self.sample.add(value)
+
+    def report(self):
+        return {"count": self.count,
+                "distinct": min(self.distinct.count(), self.count),
+                "top": self.top.top(),
+                "sample": self.sample.values}
+
+
+def add_inventory(elem, inventory, k=20, sample_size=10, p=12, rng=None):
+    """
+    Like add_values, adding the tag values to the KeyInventory of the key.
+    """
+    if elem.tag == "node" or elem.tag == "way":
+        for tag in elem.iter("tag"):
+            key = tag.attrib['k']
+            if not key in inventory:
+                inventory[key] = KeyInventory(k, sample_size, p, rng)
+            inventory[key].add(tag.attrib['v'])
+    return inventory
+
+def parse_inventory(file, k=20, sample_size=10, p=12, seed=0):
+    """
+    Inventory mode of parse: memory per key is fixed however many distinct
+    values the key has.
+    """
+    inventory = {}
+    rng = random.Random(seed)
+    context = ET.iterparse(file, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag in ("node", "way", "relation"):
+            add_inventory(elem, inventory, k, sample_size, p, rng)
+            root.clear()
+    return inventory
+
+def write_json(inventory, filename='general.json'):
+    report = dict((key, inventory[key].report()) for key in inventory)
+    with open(filename, 'w') as fout:
+        json.dump(report, fout, indent=2, sort_keys=True)
+    return report
+
+def check_inventory(file, k=20, sample_size=10, p=12):
+    """
+    Compares parse_inventory with exact counts of the values of every key.
+    Returns the largest relative error of the distinct counts and the keys
+    whose top values miss a value seen more than count / k times.
+    """
+    exact = defaultdict(Counter)
+    for event, elem in ET.iterparse(file):
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
-                k = tag.attrib['k'].encode('utf-8')
-                v = tag.attrib['v'].encode('utf-8')
-                if not k in data:
-                    data[k] = set([v])
-                else:
-                    data[k].add(v)
-    return data
-      
-data = parse('sample.osm')
-fout = open('general.txt','w')
-for k in data:
-    fout.write(k+':\n')
-    for v in data[k]:
-        fout.write(v+'|  ')
-    fout.write('\n\n')
-fout.write('\n\nkeys:\n')
-for k in data:
-    fout.write(k+'\n')
-#pprint.pprint(data.keys())
+                exact[tag.attrib['k']][tag.attrib['v']] += 1
+    inventory = parse_inventory(file, k, sample_size, p)
+    assert set(inventory) == set(exact)
+    max_error = 0.0
+    missed = []
+    for key in exact:
+        report = inventory[key].report()
+        distinct = len(exact[key])
+        max_error = max(max_error, abs(report["distinct"] - distinct) / float(distinct))
+        assert report["count"] == sum(exact[key].values())
+        kept = set(v for v, c, e in report["top"])
+        frequent = [v for v, c in exact[key].items() if c > report["count"] / float(k)]
+        if not kept.issuperset(frequent):
+            missed.append(key)
+    return {"keys": len(exact), "max_distinct_error": round(max_error, 4),
+            "missed_top": missed}
+
+if __name__ == "__main__":
+    write(parse('sample.osm'))
+    pprint.pprint(check_inventory('sample.osm'))
+    write_json(parse_inventory('sample.osm'))
  
\ No newline at end of file
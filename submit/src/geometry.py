@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# geometry.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Resolves the node_refs of shaped ways to coordinates while the documents
+stream out of data.iter_shaped, so consumers do not have to join the ways
+with the nodes again.
+
+During the node pass the (id, lat, lon) of every node is appended to an
+index file of fixed size records. OSM files list all nodes before the ways
+and in id order, so when the first way comes the file is already sorted;
+it is then memory-mapped and every node_ref is found with a binary search.
+Only every FENCE-th id is kept in memory to narrow the search, so memory
+stays bounded however many nodes the file has.
+
+Each way gets:
+- "geometry": [[lat, lon], ...] of the nodes found in the index
+- "bbox": [minlat, minlon, maxlat, maxlon]
+- "length": length of the line in meters
+"""
+from array import array
+from bisect import bisect_right
+import codecs
+import math
+import mmap
+import os
+import pprint
+import struct
+
+import data
+import extsort
+
+OSMFILE = "sample.osm"
+
+RECORD = struct.Struct("<qdd")
+FENCE = 4096
+EARTH_RADIUS = 6371008.8
+
+
+class NodeIndexWriter(object):
+    """
+    Appends node records to path. Records normally come in id order; from
+    the first one that does not, the file written so far becomes the first
+    run of an external sort (see extsort) and close() merges the runs, so
+    memory stays bounded either way.
+    """
+    def __init__(self, path, buffer_size=1 << 20, chunk_size=1 << 20):
+        self.path = path
+        self.file = open(path, "wb", buffer_size)
+        self.chunk_size = chunk_size
+        self.sorter = None
+        self.last = None
+        self.count = 0
+
+    def add(self, id, lat, lon):
+        id = int(id)
+        self.count += 1
+        if self.sorter is not None:
+            self.sorter.add((id, lat, lon))
+            return
+        if self.last is not None and id <= self.last:
+            self.file.close()
+            self.sorter = extsort.ExternalSorter(self.path, RECORD, self.chunk_size)
+            self.sorter.add_run(self.path)
+            self.sorter.add((id, lat, lon))
+            return
+        self.last = id
+        self.file.write(RECORD.pack(id, lat, lon))
+
+    def close(self):
+        if self.sorter is not None:
+            self.sorter.close()
+        else:
+            self.file.close()
+        return NodeIndex(self.path)
+
+    def discard(self):
+        """
+        Closes the writer and removes its files without building the index.
+        """
+        self.file.close()
+        if self.sorter is not None:
+            self.sorter.discard()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class NodeIndex(object):
+    """
+    Memory-mapped, id sorted node records with binary search lookups.
+    """
+    def __init__(self, path):
+        self.count = os.path.getsize(path) // RECORD.size
+        self.file = open(path, "rb")
+        self.mm = None
+        self.fence = array('d')
+        if self.count:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            # ids as floats are exact up to 2**53, far above OSM ids
+            for i in range(0, self.count, FENCE):
+                self.fence.append(self.id_at(i))
+
+    def __len__(self):
+        return self.count
+
+    def id_at(self, i):
+        return RECORD.unpack_from(self.mm, i * RECORD.size)[0]
+
+    def coords(self, id):
+        """
+        (lat, lon) of the node, or None if it is not in the index.
+        """
+        if not self.count:
+            return None
+        id = int(id)
+        block = bisect_right(self.fence, id) - 1
+        if block < 0:
+            return None
+        lo = block * FENCE
+        hi = min(lo + FENCE, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.id_at(mid) < id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            found, lat, lon = RECORD.unpack_from(self.mm, lo * RECORD.size)
+            if found == id:
+                return lat, lon
+        return None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.file.close()
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Distance between two points in meters.
+    """
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def resolve_way(way, index):
+    """
+    Adds geometry, bbox and length of a shaped way from the node index.
+    Refs missing from the index (clipped by the extract) are left out.
+    """
+    geometry = []
+    for ref in way.get("node_refs", []):
+        pos = index.coords(ref)
+        if pos is not None:
+            geometry.append([pos[0], pos[1]])
+    way["geometry"] = geometry
+    if geometry:
+        lats = [p[0] for p in geometry]
+        lons = [p[1] for p in geometry]
+        way["bbox"] = [min(lats), min(lons), max(lats), max(lons)]
+    else:
+        way["bbox"] = None
+    way["length"] = sum(haversine(a[0], a[1], b[0], b[1])
+                        for a, b in zip(geometry, geometry[1:]))
+    return way
+
+
+def resolve_ways(docs, index_path):
+    """
+    Passes the shaped documents through, writing nodes to the index at
+    index_path and resolving the ways once the nodes are done. Nodes that
+    come after the first way are not in the index. The index file is
+    removed at the end.
+    """
+    writer = NodeIndexWriter(index_path)
+    index = None
+    try:
+        for doc in docs:
+            if doc["type"] == "node":
+                if index is None and "pos" in doc:
+                    writer.add(doc["id"], doc["pos"][0], doc["pos"][1])
+            elif doc["type"] == "way":
+                if index is None:
+                    index = writer.close()
+                resolve_way(doc, index)
+            yield doc
+    finally:
+        if index is None:
+            writer.discard()
+        else:
+            index.close()
+            os.remove(index_path)
+
+
+def iter_resolved(file_in):
+    """
+    data.iter_shaped with the geometry of the ways resolved.
+    """
+    return resolve_ways(data.iter_shaped(file_in), "{0}.nodes".format(file_in))
+
+
+def process_map(file_in, pretty = False):
+    """
+    Like data.process_map, with the geometry of the ways in the JSON file.
+    """
+    file_out = "{0}.json".format(file_in)
+    with codecs.open(file_out, "w") as fo:
+        return data.write_shaped(iter_resolved(file_in), fo, pretty)
+
+
+def check_unordered(index_path="check.nodes"):
+    """
+    Asserts that nodes out of id order are resolved, and that no index or
+    run file is left behind, with and without a way after them.
+    """
+    nodes = [{"type": "node", "id": "2", "pos": [1.0, 2.0]},
+             {"type": "node", "id": "1", "pos": [3.0, 4.0]}]
+    way = {"type": "way", "id": "3", "node_refs": ["1", "2", "4"]}
+    for docs in (nodes, nodes + [way]):
+        docs = [dict(doc) for doc in docs]
+        assert len(list(resolve_ways(iter(docs), index_path))) == len(docs)
+        leftover = [name for name in os.listdir(os.path.dirname(os.path.abspath(index_path)))
+                    if name.startswith(os.path.basename(index_path))]
+        assert not leftover, leftover
+    assert docs[-1]["geometry"] == [[3.0, 4.0], [1.0, 2.0]]
+
+
+def test():
+    check_unordered()
+    for doc in iter_resolved(OSMFILE):
+        if doc["type"] == "way":
+            pprint.pprint(doc)
+            break
+
+
+if __name__ == "__main__":
+    test()
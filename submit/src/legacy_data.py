@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# legacy_data.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Frozen copy of the first shaping code: shape_element, process_toptags and
+process_subtags of data.py and the cleaning functions of audit.py they
+called, unchanged. It is the golden reference of
+benchmark.benchmark_shape_element, so it must not import the current
+data.py or audit.py and must not be edited.
+"""
+import re
+
+street_type_re = re.compile(r'\bSt\.?$', re.IGNORECASE)
+
+mapping = { "St": "Street",
+            "ave.": "Avenue",
+            "Rd": "Road",
+            "St.": "Street"
+            }
+
+def correct_street_type(street_name):
+    """
+    Correct potentially problematic street names and return both correct name and whether it's been corrected
+    """
+    street_name = street_name.strip()
+    words = street_name.split()
+    new_words = []
+    # change street abbreviation to full name
+    for w in words:
+        if w in mapping:
+            new_words.append(mapping[w])
+        else:
+            new_words.append(w)
+    new_street_name = ' '.join(new_words)
+    changed = (street_name != new_street_name)
+
+    return new_street_name, changed
+
+def correct_postcode(postcode):
+    changed = 0
+    if "-" in postcode:
+        return None, 1
+    else:
+        return postcode, 0
+    
+def correct_number(num):
+    changed = 0
+    new_num = ''
+    if " / " in num:
+        new_num = for_each_num(num, " / ")
+    elif ';' in num:
+        new_num = for_each_num(num, ";")
+    elif "+8610-88087384" in num and "88086667" in num:  # "+8610-88087384；88086667" which contain a unicode ';'
+        ewnum = for_each_num('+8610-88087384;88086667', ";")
+    elif len(num.split('/')[0]) == (len(num) - 1) / 2:
+        new_num = for_each_num(num, "/")
+    else:
+        new_num = pure_num(num)
+
+    # print num + '=>' + newnum
+    if num == new_num:
+        return num,False
+    else:
+        return new_num, True
+
+def for_each_num(allnum, seq):
+    r = ''
+    for n in allnum.split(seq):
+        n = pure_num(n)
+        r = r + n + ','
+    r = r[:-1] 
+    return r
+
+#get only the integers of a string, and standardize the header "86010" 
+def pure_num(num):
+    
+    r = re.sub('[^0-9]', '', num)
+    if r[:4] == "8610":
+        r = "86010" + r[4:]
+    elif r[:2] == '00':
+        r = r[2:]
+        
+    return r
+
+
+lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
+
+
+def shape_element(element):
+    """
+    Takes an XML tag as input and returns a cleaned and reshaped
+    dictionary for JSON ouput. If the element contains an abbreviated
+    street name, it returns with an updated full street name.
+    """
+    node = {}
+    # you should process only 2 types of top level tags: "node" and "way"
+    if element.tag == "node" or element.tag == "way" :
+        for key in element.attrib.keys():
+            val = element.attrib[key]
+            node["type"] = element.tag
+
+            # deal with top-level tags  
+            node = process_toptags(key,val, node)
+            
+            # Begin iterating over subtags
+            node = process_subtags(element, node)
+            
+        for tag in element.iter("nd"):
+            if not "node_refs" in node.keys():
+                node["node_refs"] = []
+            node_refs = node["node_refs"]
+            node_refs.append(tag.attrib["ref"])
+            node["node_refs"] = node_refs
+
+        return node
+    else:
+        return None
+
+def process_toptags(key, val, node):
+    """
+    Takes a key-value pair and add store them according to different situation:
+    CREATED list, coordinates, or others.
+    """
+    # If key in CREATED list, store key-val under "created"
+    if key in CREATED:
+        if not "created" in node.keys():
+            node["created"] = {}
+        node["created"][key] = val
+        
+    # Fetch coordinates 
+    elif key == "lat" or key == "lon":
+        if not "pos" in node.keys():
+            node["pos"] = [0.0, 0.0]
+        old_pos = node["pos"]
+        if key == "lat":
+            new_pos = [float(val), old_pos[1]]
+        else:
+            new_pos = [old_pos[0], float(val)]
+        node["pos"] = new_pos
+    else:
+        node[key] = val
+        
+    return node
+
+def process_subtags(element, node):
+    """
+    Iterating over subtags and store key and fixed value to node dict. 
+    """
+    
+    for tag in element.iter("tag"):
+        tag_key = tag.attrib['k']
+        tag_val = tag.attrib['v']
+        
+        # Check for problem characters
+        if problemchars.match(tag_key):
+            continue
+        
+        # fix tag 'v' attribute of streetname and postcode
+        elif tag_key.startswith("addr:"):
+            if not "address" in node.keys():
+                node["address"] = {}
+            addr_key = tag.attrib['k'][len("addr:") : ]
+            if lower_colon.match(addr_key):
+                continue
+            else:
+                if tag.attrib['k'] == "addr:street":
+                    fixed_v, change = correct_street_type(tag_val)
+                elif tag.attrib['k'] == "addr:postcode":
+                    fixed_v, change = correct_postcode(tag.attrib['v'])
+                else:
+                    fixed_v = tag_val
+                if fixed_v != None:
+                    node["address"][addr_key] = fixed_v
+        
+        # fix fax and phone number
+        elif tag_key == "fax" or tag_key == "phone":
+            fixed_v, chang = correct_number(tag_val)
+            node[tag_key] = fixed_v
+            
+        #fix multiple tag_key confusing. These two tag_key in the list have same meaing, 
+        #so just keep the latter one in the list and change the former to the latter
+        elif tag_key in [ u'应急避难场所疏散人数万人',u'应急避难场所疏散人口万人']:
+            node[u'应急避难场所疏散人口万人'] = tag_val
+            
+        # '疏散人数' and '疏散人数（万）' are two similar tag_key. Inthis way below, we change '疏散人数' to '疏散人数（万）'
+        # by doing some math.
+        elif tag_key == u'疏散人数':
+            node[u'疏散人数（万）'] = str(round(float(tag_val.split()[0].replace(',',''))/10000,2))
+        elif tag_val != None:
+            node[tag_key] = tag_val
+            
+    return node
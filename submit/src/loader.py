@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# loader.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Loads shaped OSM documents into MongoDB without going through a JSON file
+and mongoimport. The documents (for example data.iter_shaped) are cut into
+batches that a few writer threads insert with unordered insert_many over a
+shared, pooled client. The batch queue is bounded, so reading the OSM file
+waits for the writers instead of piling up documents in memory.
+
+Elements are unique by (type, id): a unique index on them makes loading
+idempotent, and with resume=True the documents already in the collection
+are filtered out per batch, so a failed load can be restarted from the
+beginning of the file. Any pymongo compatible collection works, including
+mongomock's.
+"""
+import pprint
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import data
+
+try:
+    from pymongo.errors import BulkWriteError
+except ImportError:
+    class BulkWriteError(Exception):
+        """
+        Stand-in for pymongo's error of a failed bulk write, with the same
+        details dictionary.
+        """
+        def __init__(self, results):
+            Exception.__init__(self, "batch op errors occurred")
+            self.details = results
+
+OSMFILE = "sample.osm"
+
+DUPLICATE_KEY = 11000
+
+
+def get_collection(uri="mongodb://localhost:27017", db="osm", name="beijing",
+                   pool_size=8):
+    from pymongo import MongoClient
+    client = MongoClient(uri, maxPoolSize=pool_size)
+    return client[db][name]
+
+
+def batches(docs, batch_size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkLoader(object):
+    """
+    Inserts batches of documents with writers threads. Counters are
+    updated under a lock; the first error of a writer is raised in the
+    thread calling load.
+    """
+    def __init__(self, collection, batch_size=1000, writers=4, resume=False):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.writers = writers
+        self.resume = resume
+        self.queue = queue.Queue(maxsize=writers * 2)
+        self.lock = threading.Lock()
+        self.error = None
+        self.stats = {"inserted": 0, "skipped": 0, "duplicates": 0}
+
+    def count(self, **counts):
+        with self.lock:
+            for key in counts:
+                self.stats[key] += counts[key]
+
+    def existing(self, batch):
+        """
+        (type, id) of the documents of batch already in the collection.
+        """
+        ids = [doc["id"] for doc in batch]
+        found = self.collection.find({"id": {"$in": ids}},
+                                     {"_id": 0, "type": 1, "id": 1})
+        return set((doc.get("type"), doc["id"]) for doc in found)
+
+    def insert(self, batch):
+        if self.resume:
+            existing = self.existing(batch)
+            if existing:
+                loaded = len(batch)
+                batch = [doc for doc in batch
+                         if (doc.get("type"), doc["id"]) not in existing]
+                self.count(skipped=loaded - len(batch))
+                if not batch:
+                    return
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self.count(inserted=len(batch))
+        except Exception as e:
+            # with ordered=False everything but the duplicates is inserted
+            details = getattr(e, "details", None) or {}
+            errors = details.get("writeErrors")
+            if not errors or details.get("writeConcernErrors") or \
+                    any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+            self.count(inserted=len(batch) - len(errors),
+                       duplicates=len(errors))
+
+    def write(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.error is None:
+                try:
+                    self.insert(batch)
+                except Exception as e:
+                    self.error = e
+
+    def load(self, docs):
+        """
+        Inserts all docs and returns the counters together with the elapsed
+        seconds and documents per second.
+        """
+        self.collection.create_index([("type", 1), ("id", 1)], unique=True)
+        threads = [threading.Thread(target=self.write)
+                   for _ in range(self.writers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        start = time.time()
+        try:
+            for batch in batches(docs, self.batch_size):
+                if self.error is not None:
+                    break
+                self.queue.put(batch)
+        finally:
+            for thread in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+        seconds = time.time() - start
+        stats = dict(self.stats)
+        stats["seconds"] = round(seconds, 3)
+        stats["docs_per_sec"] = int(stats["inserted"] / seconds) if seconds else 0
+        return stats
+
+
+def load(docs, collection, batch_size=1000, writers=4, resume=False):
+    """
+    Inserts the shaped documents into collection, see BulkLoader.
+    """
+    return BulkLoader(collection, batch_size, writers, resume).load(docs)
+
+
+def load_map(file_in, collection, batch_size=1000, writers=4, resume=False):
+    """
+    Shapes file_in and loads the documents straight into collection.
+    """
+    return load(data.iter_shaped(file_in), collection, batch_size, writers,
+                resume)
+
+
+class FakeCollection(object):
+    """
+    The part of a pymongo collection the loader uses, for testing without a
+    mongod: documents unique by (type, id) and unordered insert_many which
+    inserts every document it can and raises BulkWriteError with the
+    duplicate key errors. Every insert takes delay seconds.
+    """
+    def __init__(self, delay=0.0):
+        self.docs = {}
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def create_index(self, keys, unique=False):
+        pass
+
+    def find(self, query, projection=None):
+        with self.lock:
+            docs = list(self.docs.values())
+        if "id" in query:
+            ids = set(query["id"]["$in"])
+            docs = [doc for doc in docs if doc["id"] in ids]
+        return [{"type": doc["type"], "id": doc["id"]} for doc in docs]
+
+    def insert_many(self, docs, ordered=True):
+        time.sleep(self.delay)
+        errors = []
+        with self.lock:
+            for i, doc in enumerate(docs):
+                key = (doc["type"], doc["id"])
+                if key in self.docs:
+                    errors.append({"index": i, "code": DUPLICATE_KEY})
+                    if ordered:
+                        break
+                else:
+                    self.docs[key] = dict(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [],
+                                  "nInserted": len(docs) - len(errors)})
+
+
+def test_collection():
+    """
+    A mongomock collection if mongomock is installed, else a FakeCollection.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        return FakeCollection()
+    return mongomock.MongoClient().osm.test
+
+
+def count_docs(collection):
+    return len(list(collection.find({}, {"_id": 0, "type": 1, "id": 1})))
+
+
+def check_loader(new_collection=test_collection):
+    """
+    Asserts the counters of a resumed load, of a load with duplicates and
+    that reading waits for slow writers.
+    """
+    docs = [{"type": "node", "id": str(i)} for i in range(1000)]
+    docs.append({"type": "way", "id": "5"})
+
+    def copies(docs):
+        return (dict(doc) for doc in docs)
+
+    # a load that stopped after 400 documents, restarted from the beginning
+    collection = new_collection()
+    stats = load(copies(docs[:400]), collection, batch_size=50, writers=3)
+    assert stats["inserted"] == 400
+    stats = load(copies(docs), collection, batch_size=50, writers=3, resume=True)
+    assert (stats["inserted"], stats["skipped"], stats["duplicates"]) == (601, 400, 0)
+    assert count_docs(collection) == 1001
+
+    # without resume the documents already loaded are duplicate key errors
+    collection = new_collection()
+    load(copies(docs[:300]), collection, batch_size=100)
+    stats = load(copies(docs[250:350]), collection, batch_size=100)
+    assert (stats["inserted"], stats["duplicates"]) == (50, 50)
+    assert count_docs(collection) == 350
+
+    # the bounded queue keeps reading at most a few batches ahead of the
+    # writers
+    collection = FakeCollection(delay=0.01)
+    ahead = [0]
+
+    def produce():
+        for i, doc in enumerate(copies(docs)):
+            ahead[0] = max(ahead[0], i - len(collection.docs))
+            yield doc
+
+    writers, batch_size = 2, 10
+    load(produce(), collection, batch_size=batch_size, writers=writers)
+    assert len(collection.docs) == len(docs)
+    assert ahead[0] <= (writers * 3 + 2) * batch_size, ahead[0]
+
+
+def test():
+    check_loader()
+    collection = get_collection()
+    pprint.pprint(load_map(OSMFILE, collection, resume=True))
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# nodestore.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Compact storage of node coordinates. Instead of a dictionary with a [lat, lon]
+list per node, NodeStore keeps three flat arrays: the node ids (int64) and
+their latitudes and longitudes (float64), 24 bytes per node. Nodes can be
+added while shaping (see data.iter_shaped); after freeze() the ids are
+sorted and looked up with a binary search. When NumPy is installed freeze
+turns the arrays into NumPy arrays and lookup_many is vectorized. Without
+it, nodes added out of id order are sorted with extsort on packed records,
+so sorting does not need a Python object per node.
+
+A store can be saved to and loaded from three raw array files
+("<path>.ids", "<path>.lat", "<path>.lon").
+"""
+from array import array
+from bisect import bisect_left
+import os
+import random
+import struct
+import tempfile
+
+import extsort
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# array has no int64 code on Python 2, but 'l' is 64 bits on 64 bit Linux
+try:
+    array('q')
+    ID_TYPE = 'q'
+except ValueError:
+    ID_TYPE = 'l'
+
+# id, position it was added at (keeps equal ids in order, like the stable
+# NumPy sort), lat, lon
+SORT_RECORD = struct.Struct("<qqdd")
+
+
+def read_array(values, f):
+    if hasattr(values, "frombytes"):
+        values.frombytes(f.read())
+    else:
+        values.fromstring(f.read())
+
+
+class Node(object):
+    """
+    A single node of the store.
+    """
+    __slots__ = ("id", "lat", "lon")
+
+    def __init__(self, id, lat, lon):
+        self.id = id
+        self.lat = lat
+        self.lon = lon
+
+    @property
+    def pos(self):
+        return [self.lat, self.lon]
+
+    def __repr__(self):
+        return "Node({0}, {1}, {2})".format(self.id, self.lat, self.lon)
+
+
+class NodeStore(object):
+    """
+    Node ids and coordinates in flat arrays, see the module docstring.
+    """
+    def __init__(self):
+        self.ids = array(ID_TYPE)
+        self.lats = array('d')
+        self.lons = array('d')
+        self.ordered = True
+        self.frozen = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, id, lat, lon):
+        id = int(id)
+        if self.frozen:
+            raise ValueError("can not add to a frozen NodeStore")
+        if self.ordered and self.ids and id <= self.ids[-1]:
+            self.ordered = False
+        self.ids.append(id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def add_shaped(self, node):
+        """
+        Adds a shaped node dictionary (see data.shape_element).
+        """
+        if node.get("type") == "node" and "pos" in node:
+            self.add(node["id"], node["pos"][0], node["pos"][1])
+
+    def freeze(self, chunk_size=1 << 18):
+        """
+        Sorts the nodes by id, only needed if they were not added in order,
+        and switches to NumPy arrays if available. Returns the store.
+        Without NumPy at most chunk_size nodes are sorted in memory at a
+        time.
+        """
+        if self.frozen:
+            return self
+        if np is not None:
+            ids = np.frombuffer(self.ids, dtype=np.int64)
+            lats = np.frombuffer(self.lats, dtype=np.float64)
+            lons = np.frombuffer(self.lons, dtype=np.float64)
+            if not self.ordered:
+                order = np.argsort(ids, kind="mergesort")
+                ids, lats, lons = ids[order], lats[order], lons[order]
+            self.ids, self.lats, self.lons = ids, lats, lons
+        elif not self.ordered:
+            self.sort_external(chunk_size)
+        self.ordered = True
+        self.frozen = True
+        return self
+
+    def sort_external(self, chunk_size):
+        fd, path = tempfile.mkstemp(suffix=".nodes")
+        os.close(fd)
+        sorter = extsort.ExternalSorter(path, SORT_RECORD, chunk_size)
+        try:
+            for i in range(len(self.ids)):
+                sorter.add((self.ids[i], i, self.lats[i], self.lons[i]))
+            # the arrays are rebuilt from the sorted file, free them first
+            self.ids, self.lats, self.lons = array(ID_TYPE), array('d'), array('d')
+            sorter.close()
+            for id, _, lat, lon in extsort.read_records(path, SORT_RECORD):
+                self.ids.append(id)
+                self.lats.append(lat)
+                self.lons.append(lon)
+        finally:
+            sorter.discard()
+            os.remove(path)
+
+    def index(self, id):
+        """
+        Position of id in the arrays, or -1.
+        """
+        if not self.frozen:
+            self.freeze()
+        id = int(id)
+        i = bisect_left(self.ids, id) if np is None else \
+            int(np.searchsorted(self.ids, id))
+        if i < len(self.ids) and self.ids[i] == id:
+            return i
+        return -1
+
+    def __contains__(self, id):
+        return self.index(id) >= 0
+
+    def coords(self, id):
+        """
+        (lat, lon) of the node, or None if it is not in the store.
+        """
+        i = self.index(id)
+        if i < 0:
+            return None
+        return float(self.lats[i]), float(self.lons[i])
+
+    def get(self, id):
+        i = self.index(id)
+        if i < 0:
+            return None
+        return Node(int(self.ids[i]), float(self.lats[i]), float(self.lons[i]))
+
+    def lookup_many(self, ids):
+        """
+        List of (lat, lon), or None for missing ids, of all ids.
+        """
+        if np is None or not len(self.ids):
+            return [self.coords(id) for id in ids]
+        self.freeze()
+        wanted = np.asarray([int(id) for id in ids], dtype=np.int64)
+        found = np.searchsorted(self.ids, wanted)
+        found[found == len(self.ids)] = 0
+        hit = self.ids[found] == wanted
+        return [(float(self.lats[i]), float(self.lons[i])) if h else None
+                for i, h in zip(found.tolist(), hit.tolist())]
+
+    def save(self, path):
+        self.freeze()
+        for suffix, values in (("ids", self.ids), ("lat", self.lats),
+                               ("lon", self.lons)):
+            with open("{0}.{1}".format(path, suffix), "wb") as f:
+                values.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        for suffix, values in (("ids", store.ids), ("lat", store.lats),
+                               ("lon", store.lons)):
+            with open("{0}.{1}".format(path, suffix), "rb") as f:
+                read_array(values, f)
+        return store.freeze()
+
+
+def test():
+    random.seed(0)
+    nodes = [(random.randint(1, 5000), random.random(), random.random())
+             for _ in range(20000)]
+    store = NodeStore()
+    for node in nodes:
+        store.add(*node)
+    store.freeze(chunk_size=1000)
+    # equal ids keep the order they were added in
+    first = {}
+    for id, lat, lon in nodes:
+        first.setdefault(id, (lat, lon))
+    assert list(store.ids) == sorted(id for id, _, _ in nodes)
+    assert all(store.coords(id) == coords for id, coords in first.items())
+    assert store.coords(0) is None and store.coords(5001) is None
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pbf.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Reader for OSM PBF files (.osm.pbf), the protobuf encoding of OSM data,
+written against the wire format so it needs no protobuf package.
+
+A PBF file is a sequence of blobs: a 4 byte length, a BlobHeader and a
+zlib compressed Blob. The first blob is the OSMHeader, every other one an
+OSMData PrimitiveBlock of up to 8000 nodes (plain or dense), ways or
+relations. iter_elements reads the blob headers and has the blobs decoded
+by a pool of worker processes, then yields each node, way and relation as
+an ElementTree element with the same attributes and <tag>, <nd> and
+<member> children as in the XML file, so shape_element and the audit code
+work on them unchanged. iterparse mimics the end events of ET.iterparse.
+
+write_pbf converts an XML file to PBF (dense nodes, zlib blobs); it is
+used to make small test files such as one from example.osm.
+"""
+import xml.etree.cElementTree as ET
+from collections import deque
+from decimal import Decimal
+import calendar
+import multiprocessing
+import struct
+import time
+import zlib
+
+OSMFILE = "example.osm"
+
+NANO = 1000000000
+MEMBER_TYPES = ("node", "way", "relation")
+HEADER_LENGTH = struct.Struct(">I")
+
+
+# ---------------------------------------------------------------- decoding
+
+def varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def signed(n):
+    """
+    Two's complement value of a 64 bit int64/int32 varint.
+    """
+    return n - (1 << 64) if n >= (1 << 63) else n
+
+
+def fields(buf, pos, end):
+    """
+    Yields (field number, value) of a message in buf[pos:end]. Length
+    delimited values are (start, end) positions into buf.
+    """
+    while pos < end:
+        key, pos = varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = varint(buf, pos)
+        elif wire == 2:
+            length, pos = varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("unsupported wire type {0}".format(wire))
+        yield key >> 3, value
+
+
+def packed(buf, span):
+    # varint() inlined, most packed values (deltas, string ids) fit in a byte
+    pos, end = span
+    values = []
+    append = values.append
+    while pos < end:
+        b = buf[pos]
+        pos += 1
+        if b < 0x80:
+            append(b)
+            continue
+        result = b & 0x7f
+        shift = 7
+        while True:
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values
+
+
+def deltas(values):
+    """
+    Undoes the delta coding of zigzag encoded packed values.
+    """
+    total = 0
+    result = []
+    for value in values:
+        total += zigzag(value)
+        result.append(total)
+    return result
+
+
+def degrees(nano):
+    """
+    Exact decimal string of a coordinate given in nanodegrees.
+    """
+    whole, part = divmod(abs(nano), NANO)
+    text = "{0}{1}.{2:09d}".format("-" if nano < 0 else "", whole, part)
+    return text.rstrip("0").rstrip(".")
+
+
+class Block(object):
+    """
+    Decodes one PrimitiveBlock into entity tuples
+    (tag, attrib, tags, node refs, members).
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.strings = []
+        self.groups = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.date_granularity = 1000
+        for field, value in fields(buf, 0, len(buf)):
+            if field == 1:
+                self.strings = [buf[s:e].decode("utf-8")
+                                for f, (s, e) in fields(buf, value[0], value[1])
+                                if f == 1]
+            elif field == 2:
+                self.groups.append(value)
+            elif field == 17:
+                self.granularity = value
+            elif field == 18:
+                self.date_granularity = value
+            elif field == 19:
+                self.lat_offset = signed(value)
+            elif field == 20:
+                self.lon_offset = signed(value)
+
+    def coord(self, offset, value):
+        return degrees(offset + self.granularity * value)
+
+    def timestamp(self, value):
+        seconds = value * self.date_granularity // 1000
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+    def info(self, span, attrib):
+        buf = self.buf
+        for field, value in fields(buf, span[0], span[1]):
+            if field == 1:
+                attrib["version"] = str(value)
+            elif field == 2:
+                attrib["timestamp"] = self.timestamp(signed(value))
+            elif field == 3:
+                attrib["changeset"] = str(signed(value))
+            elif field == 4:
+                attrib["uid"] = str(signed(value))
+            elif field == 5:
+                attrib["user"] = self.strings[value]
+            elif field == 6:
+                attrib["visible"] = "true" if value else "false"
+        return attrib
+
+    def keys_vals(self, keys, vals):
+        return [(self.strings[k], self.strings[v]) for k, v in zip(keys, vals)]
+
+    def entities(self):
+        buf = self.buf
+        for start, end in self.groups:
+            for field, span in fields(buf, start, end):
+                if field == 1:
+                    yield self.node(span)
+                elif field == 2:
+                    for entity in self.dense(span):
+                        yield entity
+                elif field == 3:
+                    yield self.way(span)
+                elif field == 4:
+                    yield self.relation(span)
+
+    def node(self, span):
+        buf = self.buf
+        attrib, keys, vals = {}, [], []
+        lat = lon = 0
+        for field, value in fields(buf, span[0], span[1]):
+            if field == 1:
+                attrib["id"] = str(zigzag(value))
+            elif field == 2:
+                keys = packed(buf, value)
+            elif field == 3:
+                vals = packed(buf, value)
+            elif field == 4:
+                self.info(value, attrib)
+            elif field == 8:
+                lat = zigzag(value)
+            elif field == 9:
+                lon = zigzag(value)
+        attrib["lat"] = self.coord(self.lat_offset, lat)
+        attrib["lon"] = self.coord(self.lon_offset, lon)
+        return "node", attrib, self.keys_vals(keys, vals), [], []
+
+    def dense(self, span):
+        buf = self.buf
+        ids, lats, lons, keys_vals = [], [], [], []
+        info = {}
+        for field, value in fields(buf, span[0], span[1]):
+            if field == 1:
+                ids = deltas(packed(buf, value))
+            elif field == 5:
+                for f, v in fields(buf, value[0], value[1]):
+                    info[f] = packed(buf, v)
+            elif field == 8:
+                lats = deltas(packed(buf, value))
+            elif field == 9:
+                lons = deltas(packed(buf, value))
+            elif field == 10:
+                keys_vals = packed(buf, value)
+        if 1 in info:
+            info[1] = [str(signed(v)) for v in info[1]]
+        for f, convert in ((2, self.timestamp), (3, str), (4, str),
+                           (5, self.strings.__getitem__)):
+            if f in info:
+                info[f] = [convert(v) for v in deltas(info[f])]
+        if 6 in info:
+            info[6] = ["true" if v else "false" for v in info[6]]
+        names = {1: "version", 2: "timestamp", 3: "changeset", 4: "uid",
+                 5: "user", 6: "visible"}
+        kv = 0
+        for i, id in enumerate(ids):
+            attrib = {"id": str(id),
+                      "lat": self.coord(self.lat_offset, lats[i]),
+                      "lon": self.coord(self.lon_offset, lons[i])}
+            for f in info:
+                attrib[names[f]] = info[f][i]
+            tags = []
+            if keys_vals:
+                while keys_vals[kv] != 0:
+                    tags.append((self.strings[keys_vals[kv]],
+                                 self.strings[keys_vals[kv + 1]]))
+                    kv += 2
+                kv += 1
+            yield "node", attrib, tags, [], []
+
+    def way(self, span):
+        buf = self.buf
+        attrib, keys, vals, refs = {}, [], [], []
+        for field, value in fields(buf, span[0], span[1]):
+            if field == 1:
+                attrib["id"] = str(signed(value))
+            elif field == 2:
+                keys = packed(buf, value)
+            elif field == 3:
+                vals = packed(buf, value)
+            elif field == 4:
+                self.info(value, attrib)
+            elif field == 8:
+                refs = [str(ref) for ref in deltas(packed(buf, value))]
+        return "way", attrib, self.keys_vals(keys, vals), refs, []
+
+    def relation(self, span):
+        buf = self.buf
+        attrib, keys, vals = {}, [], []
+        roles, memids, types = [], [], []
+        for field, value in fields(buf, span[0], span[1]):
+            if field == 1:
+                attrib["id"] = str(signed(value))
+            elif field == 2:
+                keys = packed(buf, value)
+            elif field == 3:
+                vals = packed(buf, value)
+            elif field == 4:
+                self.info(value, attrib)
+            elif field == 8:
+                roles = [signed(v) for v in packed(buf, value)]
+            elif field == 9:
+                memids = deltas(packed(buf, value))
+            elif field == 10:
+                types = packed(buf, value)
+        members = [(MEMBER_TYPES[t], str(ref), self.strings[role])
+                   for t, ref, role in zip(types, memids, roles)]
+        return "relation", attrib, self.keys_vals(keys, vals), [], members
+
+
+def read_blob(f, offset, size):
+    """
+    Uncompressed content of the Blob at offset.
+    """
+    f.seek(offset)
+    buf = bytearray(f.read(size))
+    raw = None
+    for field, value in fields(buf, 0, len(buf)):
+        if field == 1:
+            raw = bytes(buf[value[0]:value[1]])
+        elif field == 3:
+            raw = zlib.decompress(bytes(buf[value[0]:value[1]]))
+        elif field in (4, 5, 6, 7):
+            raise ValueError("only raw and zlib PBF blobs are supported")
+    return bytearray(raw)
+
+
+def blobs(path):
+    """
+    Yields (type, offset, size) of every blob of the file.
+    """
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            head = f.read(HEADER_LENGTH.size)
+            if len(head) < HEADER_LENGTH.size:
+                return
+            length = HEADER_LENGTH.unpack(head)[0]
+            header = bytearray(f.read(length))
+            kind, size = None, 0
+            for field, value in fields(header, 0, length):
+                if field == 1:
+                    kind = bytes(header[value[0]:value[1]]).decode("ascii")
+                elif field == 3:
+                    size = value
+            offset += HEADER_LENGTH.size + length
+            yield kind, offset, size
+            offset += size
+            f.seek(offset)
+
+
+def decode_block(task):
+    """
+    Entity tuples of the OSMData blob of task (path, offset, size).
+    """
+    path, offset, size = task
+    with open(path, "rb") as f:
+        return list(Block(read_blob(f, offset, size)).entities())
+
+
+def read_header(path):
+    """
+    The bounding box of the OSMHeader as a bounds attrib dict, or None.
+    """
+    for kind, offset, size in blobs(path):
+        if kind != "OSMHeader":
+            continue
+        with open(path, "rb") as f:
+            buf = read_blob(f, offset, size)
+        for field, span in fields(buf, 0, len(buf)):
+            if field == 1:
+                box = dict((f, degrees(zigzag(v)))
+                           for f, v in fields(buf, span[0], span[1]))
+                return {"minlon": box[1], "maxlon": box[2],
+                        "maxlat": box[3], "minlat": box[4]}
+        return None
+    return None
+
+
+def to_element(entity):
+    tag, attrib, tags, refs, members = entity
+    element = ET.Element(tag, attrib)
+    for k, v in tags:
+        ET.SubElement(element, "tag", {"k": k, "v": v})
+    for ref in refs:
+        ET.SubElement(element, "nd", {"ref": ref})
+    for member_type, ref, role in members:
+        ET.SubElement(element, "member", {"type": member_type, "ref": ref,
+                                          "role": role})
+    return element
+
+
+def imap_bounded(func, tasks, workers, in_flight=2):
+    """
+    Yields func(task) for every task in order, computed in a pool of
+    workers processes. At most in_flight tasks per worker are submitted
+    ahead of the consumer, so a slow consumer does not make the decoded
+    blocks pile up in memory.
+    """
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(pool.apply_async(func, (task,)))
+            if len(pending) >= workers * in_flight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def iter_elements(path, workers=1):
+    """
+    Yields every node, way and relation of the PBF file as an element, in
+    file order. With workers > 1 the blobs are decoded in a process pool,
+    a few blocks ahead of the consumer.
+    """
+    tasks = ((path, offset, size) for kind, offset, size in blobs(path)
+             if kind == "OSMData")
+    if workers > 1:
+        blocks = imap_bounded(decode_block, tasks, workers)
+    else:
+        blocks = (decode_block(task) for task in tasks)
+    for entities in blocks:
+        for entity in entities:
+            yield to_element(entity)
+
+
+def iterparse(path, workers=1):
+    """
+    Yields ("end", element) like ET.iterparse(path) on the XML file: the
+    bounds, then every child before its node, way or relation, and the
+    osm root last.
+    """
+    bounds = read_header(path)
+    if bounds is not None:
+        yield "end", ET.Element("bounds", bounds)
+    for element in iter_elements(path, workers):
+        for child in element:
+            yield "end", child
+        yield "end", element
+    yield "end", ET.Element("osm")
+
+
+def is_pbf(path):
+    return str(path).endswith(".pbf")
+
+
+# ---------------------------------------------------------------- encoding
+
+def encode_varint(n):
+    out = bytearray()
+    n &= (1 << 64) - 1
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def encode_zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def field_varint(field, n):
+    return encode_varint(field << 3) + encode_varint(n)
+
+
+def field_bytes(field, raw):
+    return encode_varint((field << 3) | 2) + encode_varint(len(raw)) + raw
+
+
+def field_packed(field, values):
+    return field_bytes(field, b"".join(encode_varint(v) for v in values))
+
+
+def delta_encode(values):
+    last = 0
+    result = []
+    for value in values:
+        result.append(encode_zigzag(value - last))
+        last = value
+    return result
+
+
+def nanodegrees(text):
+    return int(Decimal(text) * NANO)
+
+
+def epoch(timestamp):
+    return calendar.timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+def write_blob(f, kind, raw):
+    blob = field_varint(2, len(raw)) + field_bytes(3, zlib.compress(raw))
+    header = field_bytes(1, kind.encode("ascii")) + field_varint(3, len(blob))
+    f.write(HEADER_LENGTH.pack(len(header)))
+    f.write(header)
+    f.write(blob)
+
+
+class BlockEncoder(object):
+    """
+    Collects the elements of one PrimitiveBlock, all of one type.
+    """
+    def __init__(self):
+        self.strings = {"": 0}
+        self.elements = []
+
+    def sid(self, text):
+        if text not in self.strings:
+            self.strings[text] = len(self.strings)
+        return self.strings[text]
+
+    def info(self, attrib):
+        out = b""
+        if "version" in attrib:
+            out += field_varint(1, int(attrib["version"]))
+        if "timestamp" in attrib:
+            out += field_varint(2, epoch(attrib["timestamp"]))
+        if "changeset" in attrib:
+            out += field_varint(3, int(attrib["changeset"]))
+        if "uid" in attrib:
+            out += field_varint(4, int(attrib["uid"]))
+        if "user" in attrib:
+            out += field_varint(5, self.sid(attrib["user"]))
+        if "visible" in attrib:
+            out += field_varint(6, attrib["visible"] == "true")
+        return out
+
+    def tags(self, element):
+        pairs = [(self.sid(t.get("k")), self.sid(t.get("v")))
+                 for t in element.iter("tag")]
+        return [k for k, _ in pairs], [v for _, v in pairs]
+
+    def dense(self):
+        nodes = self.elements
+        keys_vals = []
+        for node in nodes:
+            keys, vals = self.tags(node)
+            for k, v in zip(keys, vals):
+                keys_vals.extend((k, v))
+            keys_vals.append(0)
+        info = b""
+        attribs = [n.attrib for n in nodes]
+        if all("version" in a for a in attribs):
+            info += field_packed(1, [int(a["version"]) for a in attribs])
+        if all("timestamp" in a for a in attribs):
+            info += field_packed(2, delta_encode([epoch(a["timestamp"]) for a in attribs]))
+        if all("changeset" in a for a in attribs):
+            info += field_packed(3, delta_encode([int(a["changeset"]) for a in attribs]))
+        if all("uid" in a for a in attribs):
+            info += field_packed(4, delta_encode([int(a["uid"]) for a in attribs]))
+        if all("user" in a for a in attribs):
+            info += field_packed(5, delta_encode([self.sid(a["user"]) for a in attribs]))
+        if all("visible" in a for a in attribs):
+            info += field_packed(6, [a["visible"] == "true" for a in attribs])
+        dense = field_packed(1, delta_encode([int(a["id"]) for a in attribs]))
+        dense += field_bytes(5, info)
+        dense += field_packed(8, delta_encode([nanodegrees(a["lat"]) // 100 for a in attribs]))
+        dense += field_packed(9, delta_encode([nanodegrees(a["lon"]) // 100 for a in attribs]))
+        dense += field_packed(10, keys_vals)
+        return field_bytes(2, dense)
+
+    def way(self, element):
+        keys, vals = self.tags(element)
+        refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+        return field_bytes(3, field_varint(1, int(element.get("id"))) +
+                           field_packed(2, keys) + field_packed(3, vals) +
+                           field_bytes(4, self.info(element.attrib)) +
+                           field_packed(8, delta_encode(refs)))
+
+    def relation(self, element):
+        keys, vals = self.tags(element)
+        members = list(element.iter("member"))
+        return field_bytes(4, field_varint(1, int(element.get("id"))) +
+                           field_packed(2, keys) + field_packed(3, vals) +
+                           field_bytes(4, self.info(element.attrib)) +
+                           field_packed(8, [self.sid(m.get("role", "")) for m in members]) +
+                           field_packed(9, delta_encode([int(m.get("ref")) for m in members])) +
+                           field_packed(10, [MEMBER_TYPES.index(m.get("type")) for m in members]))
+
+    def encode(self):
+        tag = self.elements[0].tag
+        if tag == "node":
+            group = self.dense()
+        elif tag == "way":
+            group = b"".join(self.way(e) for e in self.elements)
+        else:
+            group = b"".join(self.relation(e) for e in self.elements)
+        table = sorted(self.strings, key=self.strings.get)
+        strings = b"".join(field_bytes(1, s.encode("utf-8")) for s in table)
+        return field_bytes(1, strings) + field_bytes(2, group)
+
+
+def write_pbf(osm_file, pbf_file, block_size=8000):
+    """
+    Converts the OSM XML file to PBF.
+    """
+    with open(pbf_file, "wb") as f:
+        header = field_bytes(4, b"OsmSchema-V0.6") + field_bytes(4, b"DenseNodes")
+        context = ET.iterparse(osm_file, events=("start", "end"))
+        _, root = next(context)
+        block = BlockEncoder()
+        wrote_header = False
+        for event, element in context:
+            if event != "end":
+                continue
+            if element.tag == "bounds" and not wrote_header:
+                box = b"".join(field_varint(n, encode_zigzag(nanodegrees(element.get(k))))
+                               for n, k in ((1, "minlon"), (2, "maxlon"),
+                                            (3, "maxlat"), (4, "minlat")))
+                header = field_bytes(1, box) + header
+            elif element.tag in MEMBER_TYPES:
+                if not wrote_header:
+                    write_blob(f, "OSMHeader", header)
+                    wrote_header = True
+                if block.elements and (block.elements[0].tag != element.tag or
+                                       len(block.elements) == block_size):
+                    write_blob(f, "OSMData", block.encode())
+                    block = BlockEncoder()
+                block.elements.append(element)
+                root.remove(element)
+        if not wrote_header:
+            write_blob(f, "OSMHeader", header)
+        if block.elements:
+            write_blob(f, "OSMData", block.encode())
+
+
+def test():
+    import data
+    pbf_file = "{0}.pbf".format(OSMFILE)
+    write_pbf(OSMFILE, pbf_file)
+    expected = list(data.iter_shaped(OSMFILE))
+    shaped = [data.shape_element(e) for e in iter_elements(pbf_file, 2)]
+    assert shaped == expected
+
+
+if __name__ == "__main__":
+    test()
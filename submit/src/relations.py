@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# relations.py
+# Udacity.com -- "Data Wrangling with MongoDB"
+# OpenStreetMap Data Case Study
+#
+# Kai Wang
+# wangkai0112006@163.com
+"""
+Index of the relations every way is a member of, built while the shaped
+documents stream out of data.iter_shaped. Multipolygon consumers can then
+find the relations of a way without parsing the file again.
+
+Relations come after the ways and list their members in any order, so the
+(way id, relation id) pairs are sorted externally with extsort: at most
+chunk_size pairs are kept in memory, and close() merges the sorted runs into
+a single sorted file of fixed size records which is memory-mapped and
+searched with a binary search.
+"""
+import mmap
+import os
+import pprint
+import struct
+
+import data
+import extsort
+
+OSMFILE = "sample.osm"
+
+PAIR = struct.Struct("<qq")
+
+
+class MembershipIndexWriter(object):
+    """
+    Collects (way id, relation id) pairs with bounded memory.
+    """
+    def __init__(self, path, chunk_size=1 << 20):
+        self.path = path
+        self.sorter = extsort.ExternalSorter(path, PAIR, chunk_size)
+
+    def add_relation(self, relation):
+        """
+        Adds the way members of a shaped relation.
+        """
+        for member in relation.get("members", []):
+            if member["type"] == "way":
+                self.sorter.add((int(member["ref"]), int(relation["id"])))
+
+    def close(self):
+        self.sorter.close()
+        return MembershipIndex(self.path)
+
+
+class MembershipIndex(object):
+    """
+    Memory-mapped, way id sorted (way id, relation id) pairs.
+    """
+    def __init__(self, path):
+        self.count = os.path.getsize(path) // PAIR.size
+        self.file = open(path, "rb")
+        self.mm = None
+        if self.count:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def pair_at(self, i):
+        return PAIR.unpack_from(self.mm, i * PAIR.size)
+
+    def relations(self, way_id):
+        """
+        Ids of the relations that have the way as a member.
+        """
+        way_id = int(way_id)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.pair_at(mid)[0] < way_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.count:
+            way, relation = self.pair_at(lo)
+            if way != way_id:
+                break
+            found.append(relation)
+            lo += 1
+        return found
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.file.close()
+
+
+def index_relations(docs, writer):
+    """
+    Passes the shaped documents through and adds the relations to writer.
+    Call writer.close() after the stream ends to get the index.
+    """
+    for doc in docs:
+        if doc["type"] == "relation":
+            writer.add_relation(doc)
+        yield doc
+
+
+def build_index(file_in, index_path=None):
+    """
+    Shapes file_in only to build its membership index.
+    """
+    writer = MembershipIndexWriter(index_path or "{0}.members".format(file_in))
+    for _ in index_relations(data.iter_shaped(file_in), writer):
+        pass
+    return writer.close()
+
+
+def test():
+    index = build_index(OSMFILE)
+    pprint.pprint(index.relations(index.pair_at(0)[0]) if len(index) else [])
+    index.close()
+
+
+if __name__ == "__main__":
+    test()